@@ -3,14 +3,16 @@
 #----------------------------------------------------------------------------#
 
 import json
+import functools
 import dateutil.parser
-import babel
+import babel.dates
 from flask import (
     Flask,
     render_template,
     request,
     flash,
     redirect,
+    session,
     url_for
 )
 from flask_moment import Moment
@@ -36,18 +38,34 @@ db = SQLAlchemy(app)
 migrate = Migrate(app, db)
 
 from models import *
+from queries import *
+from counters import *
+from cache import PageCache
+
+page_cache = PageCache(app.config['PAGE_CACHE_SIZE'], app.config['PAGE_CACHE_TTL'], app.config['PAGE_CACHE_BACKEND'])
 
 #----------------------------------------------------------------------------#
 # Filters.
 #----------------------------------------------------------------------------#
 
-def format_datetime(value, format='medium'):
-  date = dateutil.parser.parse(value)
-  if format == 'full':
-      format="EEEE MMMM, d, y 'at' h:mma"
-  elif format == 'medium':
-      format="EE MM, dd, y h:mma"
-  return babel.dates.format_datetime(date, format, locale='en')
+DATETIME_FORMATS = {
+  'full': "EEEE MMMM, d, y 'at' h:mma",
+  'medium': "EE MM, dd, y h:mma",
+}
+
+@functools.lru_cache(maxsize=None)
+def datetime_pattern(format, locale):
+  # Babel patterns are parsed once per (format, locale)
+  return babel.dates.parse_pattern(DATETIME_FORMATS.get(format, format)), babel.Locale.parse(locale)
+
+@functools.lru_cache(maxsize=4096)
+def format_datetime(value, format='medium', locale='en'):
+  # accepts datetimes as well as ISO strings; show listings repeat the same
+  # start times, so rendered values are memoized
+  if isinstance(value, str):
+    value = dateutil.parser.parse(value)
+  pattern, locale = datetime_pattern(format, locale)
+  return pattern.apply(value, locale)
 
 app.jinja_env.filters['datetime'] = format_datetime
 
@@ -65,39 +83,24 @@ def index():
 
 @app.route('/venues')
 def venues():
-  data = []
-  unique_city_states = Venue.query.distinct(Venue.city, Venue.state).all()
-  for city_state in unique_city_states:
-    city_state_data = {}
-    city_state_data['city'] = city_state.city
-    city_state_data['state'] = city_state.state
-    city_state_data['venues'] = []
-    venues = Venue.query.filter(Venue.city == city_state.city)
-    for venue in venues:
-      venue_data = {}
-      venue_data['id'] = venue.id
-      venue_data['name'] = venue.name
-      upcoming_shows = list(filter(lambda show: show.start_time > datetime.datetime.now(), venue.shows))
-      num_upcoming_shows = len(upcoming_shows)
-      venue_data['num_upcoming_shows'] = num_upcoming_shows
-      city_state_data['venues'].append(venue_data)
-    data.append(city_state_data)
-
-  return render_template('pages/venues.html', areas=data)
+  # venues are paged by (state, city, id) so that areas stay together
+  cursor, page_size = pagination_args()
+  rows, next_cursor = keyset_page(
+    db.session.query(Venue.city, Venue.state, Venue.id, Venue.name, Venue.num_upcoming_shows),
+    [Venue.state, Venue.city, Venue.id], cursor, page_size)
+  return render_template('pages/venues.html', areas=venue_areas(rows), total=cached_count(Venue),
+                         next_cursor=next_cursor, page_size=page_size)
 
 @app.route('/venues/search', methods=['POST'])
 def search_venues():
   # implement search on artists with partial string search. Ensure it is case-insensitive.
   
   search_term = request.form.get('search_term', '')
-  venue_query = Venue.query.filter(Venue.name.ilike('%' + search_term + '%'))
-  venue_list = []
-  for venue in venue_query:
-      venue_list.append({
-          "id": venue.id,
-          "name": venue.name,
-          "num_upcoming_shows": len(list(filter(lambda show: show.start_time > datetime.datetime.now(), venue.shows)))
-      })
+  venue_list = [{
+    "id": venue.id,
+    "name": venue.name,
+    "num_upcoming_shows": venue.num_upcoming_shows
+  } for venue in search(Venue, search_term)]
 
   response = {
       "count": len(venue_list),
@@ -108,7 +111,13 @@ def search_venues():
 @app.route('/venues/<int:venue_id>')
 def show_venue(venue_id):
   # shows the venue page with the given venue_id
-  venue = Venue.query.filter(Venue.id == venue_id)[0]
+  # pages rendered with flashed messages are neither served from nor stored in the cache
+  cacheable = '_flashes' not in session
+  page_key = page_cache.key('venue', venue_id)
+  page = page_cache.get(page_key) if cacheable else None
+  if page is not None:
+    return page
+  venue = Venue.query.options(without_shows(Venue)).filter(Venue.id == venue_id)[0]
   venue_data = {}
   venue_data['id'] = venue.id
   venue_data['name'] = venue.name
@@ -123,37 +132,33 @@ def show_venue(venue_id):
   if venue.seeking_description != None:
     venue_data['seeking_description'] = venue.seeking_description
   venue_data['image_link'] = venue.image_link
-  # using join query
-  past_shows = db.session.query(Show).join(Venue).filter(Show.venue_id == venue_id).filter(
-    Show.start_time <= datetime.datetime.now()).all()
-  upcoming_shows = db.session.query(Show).join(Venue).filter(Show.venue_id == venue_id).filter(
-    Show.start_time > datetime.datetime.now()).all()
-  # upcoming_shows = list(filter(lambda show: show.start_time > datetime.datetime.now(), venue.shows))
-  # past_shows = list(filter(lambda show: show.start_time <= datetime.datetime.now(), venue.shows))
-  upcoming_shows_count = len(upcoming_shows)
-  past_shows_count = len(past_shows)
-  venue_data['past_shows_count'] = past_shows_count
-  venue_data['upcoming_shows_count'] = upcoming_shows_count
+  past_shows, upcoming_shows = split_shows(Show.venue_id, venue_id)
+  artists = load_related(Artist, [show.artist_id for show in past_shows + upcoming_shows])
+  venue_data['past_shows_count'] = len(past_shows)
+  venue_data['upcoming_shows_count'] = len(upcoming_shows)
 
   venue_data['past_shows'] = []
   for show in past_shows:
     show_data = {}
     show_data['artist_id'] = show.artist_id
-    show_data['artist_name'] = Artist.query.filter(Artist.id == show.artist_id)[0].name
-    show_data['artist_image_link'] = Artist.query.filter(Artist.id == show.artist_id)[0].image_link
-    show_data['start_time'] = show.start_time.strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+    show_data['artist_name'] = artists[show.artist_id].name
+    show_data['artist_image_link'] = artists[show.artist_id].image_link
+    show_data['start_time'] = show.start_time
     venue_data['past_shows'].append(show_data)
 
   venue_data['upcoming_shows'] = []
   for show in upcoming_shows:
     show_data = {}
     show_data['artist_id'] = show.artist_id
-    show_data['artist_name'] = Artist.query.filter(Artist.id == show.artist_id)[0].name
-    show_data['artist_image_link'] = Artist.query.filter(Artist.id == show.artist_id)[0].image_link
-    show_data['start_time'] = show.start_time.strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+    show_data['artist_name'] = artists[show.artist_id].name
+    show_data['artist_image_link'] = artists[show.artist_id].image_link
+    show_data['start_time'] = show.start_time
     venue_data['upcoming_shows'].append(show_data)
 
-  return render_template('pages/show_venue.html', venue=venue_data)
+  page = render_template('pages/show_venue.html', venue=venue_data)
+  if cacheable:
+    page_cache.set(page_key, page)
+  return page
 
 #  Create Venue
 #  ----------------------------------------------------------------
@@ -212,9 +217,15 @@ def delete_venue(venue_id):
   # clicking that button delete it from the db then redirect the user to the homepage
   error = False
   try:
-    venue = Venue.query.get(venue_id)
+    venue = Venue.query.options(with_show_keys(Venue)).get(venue_id)
+    artist_ids = {show.artist_id for show in venue.shows}
     db.session.delete(venue)
+    db.session.flush()
+    # the venue's shows are deleted with it, so its artists are recounted
+    refresh_upcoming_shows(venue_ids=[], artist_ids=artist_ids)
     db.session.commit()
+    page_cache.invalidate('venue', venue_id)
+    page_cache.invalidate('artist', *artist_ids)
   except:
       db.session.rollback()
       error = True
@@ -233,28 +244,27 @@ def delete_venue(venue_id):
 @app.route('/artists')
 def artists():
   data = []
-  artists = Artist.query.all()
+  cursor, page_size = pagination_args()
+  artists, next_cursor = keyset_page(db.session.query(Artist.id, Artist.name), [Artist.id], cursor, page_size)
   for artist in artists:
     artist_data = {}
     artist_data['id'] = artist.id
     artist_data['name'] = artist.name
     data.append(artist_data)
 
-  return render_template('pages/artists.html', artists=data)
+  return render_template('pages/artists.html', artists=data, total=cached_count(Artist),
+                         next_cursor=next_cursor, page_size=page_size)
 
 @app.route('/artists/search', methods=['POST'])
 def search_artists():
   # implement search on artists with partial string search. Ensure it is case-insensitive.
 
   search_term = request.form.get('search_term', '')
-  artist_query = Artist.query.filter(Artist.name.ilike('%' + search_term + '%'))
-  artist_list = []
-  for artist in artist_query:
-    artist_list.append({
-      "id": artist.id,
-      "name": artist.name,
-      "num_upcoming_shows": len(list(filter(lambda show: show.start_time > datetime.datetime.now(), artist.shows)))
-    })
+  artist_list = [{
+    "id": artist.id,
+    "name": artist.name,
+    "num_upcoming_shows": artist.num_upcoming_shows
+  } for artist in search(Artist, search_term)]
 
   response = {
     "count": len(artist_list),
@@ -267,7 +277,12 @@ def search_artists():
 def show_artist(artist_id):
   # shows the artist page with the given artist_id
   # TODO: use Artist.shows instead
-  artist = Artist.query.filter(Artist.id == artist_id)[0]
+  cacheable = '_flashes' not in session
+  page_key = page_cache.key('artist', artist_id)
+  page = page_cache.get(page_key) if cacheable else None
+  if page is not None:
+    return page
+  artist = Artist.query.options(without_shows(Artist)).filter(Artist.id == artist_id)[0]
   artist_data = {}
   artist_data['id'] = artist.id
   artist_data['name'] = artist.name
@@ -282,44 +297,40 @@ def show_artist(artist_id):
   if artist.seeking_description != None:
     artist_data['seeking_description'] = artist.seeking_description
   artist_data['image_link'] = artist.image_link
-  # using join query
-  past_shows = db.session.query(Show).join(Venue).filter(Show.artist_id == artist_id).filter(
-    Show.start_time <= datetime.datetime.now()).all()
-  upcoming_shows = db.session.query(Show).join(Venue).filter(Show.artist_id == artist_id).filter(
-    Show.start_time > datetime.datetime.now()).all()
-  # upcoming_shows = list(filter(lambda show: show.start_time > datetime.datetime.now(), artist.shows))
-  # past_shows = list(filter(lambda show: show.start_time <= datetime.datetime.now(), artist.shows))
-  upcoming_shows_count = len(upcoming_shows)
-  past_shows_count = len(past_shows)
-  artist_data['past_shows_count'] = past_shows_count
-  artist_data['upcoming_shows_count'] = upcoming_shows_count
+  past_shows, upcoming_shows = split_shows(Show.artist_id, artist_id)
+  venues = load_related(Venue, [show.venue_id for show in past_shows + upcoming_shows])
+  artist_data['past_shows_count'] = len(past_shows)
+  artist_data['upcoming_shows_count'] = len(upcoming_shows)
 
   artist_data['past_shows'] = []
   for show in past_shows:
     show_data = {}
     show_data['venue_id'] = show.venue_id
-    show_data['venue_name'] = Venue.query.filter(Venue.id == show.venue_id)[0].name
-    show_data['venue_image_link'] = Venue.query.filter(Venue.id == show.venue_id)[0].image_link
-    show_data['start_time'] = show.start_time.strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+    show_data['venue_name'] = venues[show.venue_id].name
+    show_data['venue_image_link'] = venues[show.venue_id].image_link
+    show_data['start_time'] = show.start_time
     artist_data['past_shows'].append(show_data)
 
   artist_data['upcoming_shows'] = []
   for show in upcoming_shows:
     show_data = {}
     show_data['venue_id'] = show.venue_id
-    show_data['venue_name'] = Venue.query.filter(Venue.id == show.venue_id)[0].name
-    show_data['venue_image_link'] = Venue.query.filter(Venue.id == show.venue_id)[0].image_link
-    show_data['start_time'] = show.start_time.strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+    show_data['venue_name'] = venues[show.venue_id].name
+    show_data['venue_image_link'] = venues[show.venue_id].image_link
+    show_data['start_time'] = show.start_time
     artist_data['upcoming_shows'].append(show_data)
 
-  return render_template('pages/show_artist.html', artist=artist_data)
+  page = render_template('pages/show_artist.html', artist=artist_data)
+  if cacheable:
+    page_cache.set(page_key, page)
+  return page
 
 #  Update
 #  ----------------------------------------------------------------
 @app.route('/artists/<int:artist_id>/edit', methods=['GET'])
 def edit_artist(artist_id):
   form = ArtistForm()
-  artist = Artist.query.filter(Artist.id == artist_id)[0]
+  artist = Artist.query.options(without_shows(Artist)).filter(Artist.id == artist_id)[0]
   artist_data={
     "id": artist.id,
     "name": artist.name,
@@ -343,7 +354,7 @@ def edit_artist_submission(artist_id):
   form = ArtistForm(request.form, meta={'csrf': False})
   if form.validate():
     try:
-      artist = Artist.query.get(artist_id)
+      artist = Artist.query.options(without_shows(Artist)).get(artist_id)
       artist_form = form.data
       for key in artist_form:
         if artist_form[key] == '': # skip empty fields
@@ -352,6 +363,9 @@ def edit_artist_submission(artist_id):
           artist.__setattr__('website', artist_form[key])
         artist.__setattr__(key, artist_form[key])
       db.session.commit()
+      # venue pages show the names and images of the artists who played there
+      page_cache.invalidate('artist', artist_id)
+      page_cache.invalidate('venue', *show_partners(Show.artist_id, Show.venue_id, artist_id))
     except:
       db.session.rollback()
       error = True
@@ -375,7 +389,7 @@ def edit_artist_submission(artist_id):
 @app.route('/venues/<int:venue_id>/edit', methods=['GET'])
 def edit_venue(venue_id):
   form = VenueForm()
-  venue = Venue.query.filter(Venue.id == venue_id)[0]
+  venue = Venue.query.options(without_shows(Venue)).filter(Venue.id == venue_id)[0]
   venue_data={
     "id": venue.id,
     "name": venue.name,
@@ -400,7 +414,7 @@ def edit_venue_submission(venue_id):
   form = VenueForm(request.form, meta={'csrf': False})
   if form.validate():
     try:
-      venue = Venue.query.get(venue_id)
+      venue = Venue.query.options(without_shows(Venue)).get(venue_id)
       venue_form = form.data
       for key in venue_form:
         if venue_form[key] == '': # skip empty fields
@@ -409,6 +423,8 @@ def edit_venue_submission(venue_id):
           venue.__setattr__('website', venue_form[key])
         venue.__setattr__(key, venue_form[key])
       db.session.commit()
+      page_cache.invalidate('venue', venue_id)
+      page_cache.invalidate('artist', *show_partners(Show.venue_id, Show.artist_id, venue_id))
     except:
       db.session.rollback()
       error = True
@@ -483,18 +499,23 @@ def create_artist_submission():
 def shows():
   # displays list of shows at /shows
   data = []
-  shows = Show.query.all()
+  cursor, page_size = pagination_args()
+  shows, next_cursor = keyset_page(db.session.query(Show.id, Show.venue_id, Show.artist_id, Show.start_time),
+                                   [Show.start_time, Show.id], cursor, page_size)
+  venues = load_related(Venue, [show.venue_id for show in shows])
+  artists = load_related(Artist, [show.artist_id for show in shows])
   for show in shows:
     show_data = {}
     show_data['venue_id'] = show.venue_id
-    show_data['venue_name'] = Venue.query.filter(Venue.id == show.venue_id)[0].name
+    show_data['venue_name'] = venues[show.venue_id].name
     show_data['artist_id'] = show.artist_id
-    show_data['artist_name'] = Artist.query.filter(Artist.id == show.artist_id)[0].name
-    show_data['artist_image_link'] = Artist.query.filter(Artist.id == show.artist_id)[0].image_link
-    show_data['start_time'] = show.start_time.strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+    show_data['artist_name'] = artists[show.artist_id].name
+    show_data['artist_image_link'] = artists[show.artist_id].image_link
+    show_data['start_time'] = show.start_time
     data.append(show_data)
 
-  return render_template('pages/shows.html', shows=data)
+  return render_template('pages/shows.html', shows=data, total=cached_count(Show),
+                         next_cursor=next_cursor, page_size=page_size)
 
 @app.route('/shows/create')
 def create_shows():
@@ -516,7 +537,14 @@ def create_show_submission():
         start_time=show_form['start_time']
       )
       db.session.add(show)
+      increment_upcoming_shows([{
+        'venue_id': show.venue_id,
+        'artist_id': show.artist_id,
+        'start_time': show.start_time
+      }])
       db.session.commit()
+      page_cache.invalidate('venue', show.venue_id)
+      page_cache.invalidate('artist', show.artist_id)
     except:
       db.session.rollback()
       error = True
@@ -0,0 +1,99 @@
+#----------------------------------------------------------------------------#
+# Page cache.
+#----------------------------------------------------------------------------#
+
+# Rendered venue and artist pages are cached under their entity id and a
+# version stamp. Writes bump the version of every page they affect, so stale
+# pages are never served again; they just age out of the LRU.
+#
+# Pages are kept in a per-process LRU with a TTL, in front of an optional
+# shared backend. Any object with get(key), set(key, value, ttl) and an
+# incr(key) that starts missing keys at 0 works as a backend (e.g. a redis
+# client). The version stamps live in the backend when there is one, so a
+# write in one worker invalidates the pages cached by every other worker.
+# Without a backend each worker only sees its own writes.
+
+import collections
+import threading
+import time
+
+class LocalBackend(object):
+  # in-process stand-in for a shared cache, for development and tests
+  def __init__(self):
+    self.data = {}
+    self.lock = threading.Lock()
+
+  def get(self, key):
+    with self.lock:
+      value, expires = self.data.get(key, (None, None))
+      if expires is not None and expires <= time.monotonic():
+        del self.data[key]
+        return None
+      return value
+
+  def set(self, key, value, ttl=None):
+    with self.lock:
+      self.data[key] = (value, time.monotonic() + ttl if ttl else None)
+
+  def incr(self, key):
+    with self.lock:
+      value, expires = self.data.get(key, (0, None))
+      self.data[key] = (value + 1, expires)
+      return value + 1
+
+class PageCache(object):
+  def __init__(self, max_entries=1000, ttl=300, backend=None):
+    self.max_entries = max_entries
+    self.ttl = ttl
+    self.backend = backend
+    self.pages = collections.OrderedDict()
+    self.versions = collections.Counter()
+    self.lock = threading.Lock()
+
+  def version(self, kind, entity_id):
+    if self.backend is not None:
+      return int(self.backend.get('version:%s:%d' % (kind, entity_id)) or 0)
+    return self.versions[kind, entity_id]
+
+  def key(self, kind, entity_id):
+    # the key of the page at its current version. Take it before reading the
+    # page's data and store the page under it: a write committed in between
+    # bumps the version, so the page never ends up under the new key
+    return 'page:%s:%d:%d' % (kind, entity_id, self.version(kind, entity_id))
+
+  def get(self, key):
+    with self.lock:
+      page, expires = self.pages.get(key, (None, 0))
+      if page is not None and expires > time.monotonic():
+        self.pages.move_to_end(key)
+        return page
+    if self.backend is not None:
+      page = self.backend.get(key)
+      if page is not None:
+        self._store(key, page)
+        return page
+    return None
+
+  def set(self, key, page):
+    self._store(key, page)
+    if self.backend is not None:
+      self.backend.set(key, page, self.ttl)
+
+  def _store(self, key, page):
+    with self.lock:
+      self.pages[key] = (page, time.monotonic() + self.ttl)
+      self.pages.move_to_end(key)
+      while len(self.pages) > self.max_entries:
+        self.pages.popitem(last=False)
+
+  def clear(self):
+    # empties the local tier only
+    with self.lock:
+      self.pages.clear()
+
+  def invalidate(self, kind, *entity_ids):
+    for entity_id in entity_ids:
+      if self.backend is not None:
+        self.backend.incr('version:%s:%d' % (kind, entity_id))
+      with self.lock:
+        self.versions[kind, entity_id] += 1
@@ -9,5 +9,16 @@ DEBUG = True
 # Connect to the database
 
 # TODO IMPLEMENT DATABASE URL
-SQLALCHEMY_DATABASE_URI = 'postgresql://yeo@localhost:5432/fyyur'
+SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL', 'postgresql://yeo@localhost:5432/fyyur')
 SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+# Pagination of the /venues, /artists and /shows listings
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+# How long listing totals are cached before being counted again
+COUNT_CACHE_SECONDS = 60
+
+# Cache of rendered venue and artist pages; see cache.py for the backend interface
+PAGE_CACHE_SIZE = 1000
+PAGE_CACHE_TTL = 300
+PAGE_CACHE_BACKEND = None
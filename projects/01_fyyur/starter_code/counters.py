@@ -0,0 +1,111 @@
+#----------------------------------------------------------------------------#
+# Upcoming show counters.
+#----------------------------------------------------------------------------#
+
+# Venue.num_upcoming_shows and Artist.num_upcoming_shows are maintained in the
+# same transaction as the writes that change them. Shows move from upcoming to
+# past as time passes, which no write observes, so `flask rollover-shows`
+# should be scheduled (e.g. every 10 minutes from cron) to refresh the counters
+# of entities whose shows started since its last run, recorded in
+# counter_rollover, so that runs missed for any length of time are caught up.
+# `flask check-counters --fix` rebuilds every counter from scratch.
+
+import click
+import collections
+import datetime
+from app import app, db
+from models import Artist, CounterRollover, Show, Venue
+
+def increment_upcoming_shows(shows, now=None):
+  # counts new shows against their venues and artists if they are upcoming,
+  # with one UPDATE per venue/artist
+  now = now or datetime.datetime.now()
+  for model, key in ((Venue, 'venue_id'), (Artist, 'artist_id')):
+    deltas = collections.Counter(show[key] for show in shows if show['start_time'] > now)
+    if deltas:
+      table = model.__table__
+      db.session.execute(
+        table.update().where(table.c.id == db.bindparam('entity_id')).values(
+          num_upcoming_shows=table.c.num_upcoming_shows + db.bindparam('delta')),
+        [{'entity_id': entity_id, 'delta': delta} for entity_id, delta in deltas.items()]
+      )
+
+def refresh_upcoming_shows(venue_ids=None, artist_ids=None, now=None):
+  # recomputes the counters of the given venues and artists, or of every row
+  # when no ids are given, without committing
+  now = now or datetime.datetime.now()
+  for model, show_column, ids in ((Venue, Show.venue_id, venue_ids), (Artist, Show.artist_id, artist_ids)):
+    if ids is not None and len(ids) == 0:
+      continue
+    count = db.select(db.func.count(Show.id)).where(
+      show_column == model.id, Show.start_time > now).scalar_subquery()
+    statement = db.update(model).values(num_upcoming_shows=count)
+    if ids is not None:
+      statement = statement.where(model.id.in_(ids))
+    db.session.execute(statement.execution_options(synchronize_session=False))
+
+def roll_over_shows(since, now=None):
+  # refreshes the entities of every show that started in (since, now]
+  now = now or datetime.datetime.now()
+  shows = db.session.query(Show.venue_id, Show.artist_id).filter(
+    Show.start_time > since, Show.start_time <= now).distinct().all()
+  refresh_upcoming_shows(
+    venue_ids={show.venue_id for show in shows},
+    artist_ids={show.artist_id for show in shows},
+    now=now
+  )
+  return len(shows)
+
+def roll_over_since_last_run(now=None):
+  # refreshes the entities of every show that started since the last run,
+  # and records this one in the same transaction; the first run rebuilds
+  # every counter. Returns the number of venue/artist pairs refreshed, or
+  # None after a rebuild. Concurrent runs wait on the row of the last one
+  now = now or datetime.datetime.now()
+  last = db.session.query(CounterRollover).filter(CounterRollover.id == 1).with_for_update().one_or_none()
+  if last is None:
+    refresh_upcoming_shows(now=now)
+    db.session.add(CounterRollover(id=1, rolled_over_at=now))
+    return None
+  count = roll_over_shows(last.rolled_over_at, now)
+  last.rolled_over_at = now
+  return count
+
+def check_upcoming_shows(now=None):
+  # returns (model name, id, stored, actual) for every counter that disagrees
+  # with the Show table
+  now = now or datetime.datetime.now()
+  mismatches = []
+  for model, show_column in ((Venue, Show.venue_id), (Artist, Show.artist_id)):
+    actual = db.func.count(Show.id).filter(Show.start_time > now)
+    rows = db.session.query(model.id, model.num_upcoming_shows, actual.label('actual')).outerjoin(
+      Show, show_column == model.id).group_by(model.id).having(
+      model.num_upcoming_shows != actual)
+    mismatches.extend((model.__name__, row.id, row.num_upcoming_shows, row.actual) for row in rows)
+  return mismatches
+
+@app.cli.command('rollover-shows')
+@click.option('--minutes', type=int, help='Look back this far instead of from the last run.')
+def rollover_shows_command(minutes):
+  now = datetime.datetime.now()
+  if minutes is None:
+    count = roll_over_since_last_run(now)
+  else:
+    count = roll_over_shows(now - datetime.timedelta(minutes=minutes), now)
+  db.session.commit()
+  if count is None:
+    click.echo('First run: every counter rebuilt.')
+  else:
+    click.echo('Rolled over counters for %d venue/artist pairs.' % count)
+
+@app.cli.command('check-counters')
+@click.option('--fix', is_flag=True, help='Rebuild every counter from scratch.')
+def check_counters_command(fix):
+  mismatches = check_upcoming_shows()
+  for mismatch in mismatches:
+    click.echo('%s %d: stored %d, actual %d' % mismatch)
+  click.echo('%d inconsistent counters.' % len(mismatches))
+  if fix:
+    refresh_upcoming_shows()
+    db.session.commit()
+    click.echo('Counters rebuilt.')
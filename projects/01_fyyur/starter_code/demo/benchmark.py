@@ -0,0 +1,145 @@
+'''
+Benchmarks for the Fyyur views.
+
+Run from the starter_code directory against a scratch database, as the
+benchmark creates and drops the tables it seeds:
+
+    DATABASE_URL=postgresql://localhost:5432/fyyur_bench python -m demo.benchmark
+'''
+from app import app, db, format_datetime, DATETIME_FORMATS
+from models import Artist, Show, Venue
+from queries import QueryCounter
+from counters import refresh_upcoming_shows
+import babel.dates
+import datetime
+import dateutil.parser
+import sys
+import time
+
+VENUE_COUNTS = [100, 1000, 10000]
+SHOWS_PER_VENUE = 3
+
+def insert(model, rows):
+    # seeding runs in its own app context so requests made by the benchmark
+    # do not share one with it
+    with app.app_context():
+        db.session.execute(model.__table__.insert(), rows)
+        if model is Show:
+            refresh_upcoming_shows()
+        db.session.commit()
+
+def seed(num_venues, start_id):
+    # inserts venues [start_id, start_id + num_venues) with one artist and a
+    # mix of past and upcoming shows each
+    now = datetime.datetime.now()
+    venues = []
+    artists = []
+    shows = []
+    for i in range(start_id, start_id + num_venues):
+        venues.append({
+            'id': i,
+            'name': 'Venue %d' % i,
+            'genres': ['Jazz'],
+            'city': 'City %d' % (i % 50),
+            'state': 'CA',
+            'address': '%d Main Street' % i,
+            'phone': '123-123-1234',
+            'seeking_talent': False,
+        })
+        artists.append({
+            'id': i,
+            'name': 'Artist %d' % i,
+            'genres': ['Jazz'],
+            'city': 'City %d' % (i % 50),
+            'state': 'CA',
+            'phone': '123-123-1234',
+            'seeking_venue': False,
+        })
+        for j in range(SHOWS_PER_VENUE):
+            shows.append({
+                'venue_id': i,
+                'artist_id': i,
+                'start_time': now + datetime.timedelta(days=j - 1),
+            })
+    insert(Venue, venues)
+    insert(Artist, artists)
+    insert(Show, shows)
+
+def measure(client, path):
+    with app.app_context(), QueryCounter() as counter:
+        start = time.perf_counter()
+        response = client.get(path)
+        elapsed = time.perf_counter() - start
+    assert response.status_code == 200, response.status_code
+    return counter.count, elapsed
+
+def benchmark_venues():
+    client = app.test_client()
+    seeded = 0
+    print('%10s %10s %10s' % ('venues', 'queries', 'seconds'))
+    for num_venues in VENUE_COUNTS:
+        seed(num_venues - seeded, seeded + 1)
+        seeded = num_venues
+        queries, elapsed = measure(client, '/venues')
+        print('%10d %10d %10.3f' % (num_venues, queries, elapsed))
+
+def benchmark_show_pages():
+    # a single venue and artist with a growing history of shows
+    client = app.test_client()
+    seed(1, 1)
+    now = datetime.datetime.now()
+    seeded = 0
+    print('%10s %10s %10s %10s' % ('shows', 'page', 'queries', 'seconds'))
+    for num_shows in [10, 100, 2000]:
+        insert(Show, [{
+            'venue_id': 1,
+            'artist_id': 1,
+            'start_time': now + datetime.timedelta(hours=i - num_shows // 2),
+        } for i in range(num_shows - seeded)])
+        seeded = num_shows
+        for path in ['/venues/1', '/artists/1', '/shows']:
+            queries, elapsed = measure(client, path)
+            print('%10d %10s %10d %10.3f' % (num_shows, path, queries, elapsed))
+
+def legacy_format_datetime(value, format='medium'):
+    # the filter as it was before taking datetimes: every call re-parses both
+    # the ISO string and the Babel pattern
+    date = dateutil.parser.parse(value)
+    return babel.dates.format_datetime(date, DATETIME_FORMATS[format], locale='en')
+
+def benchmark_datetime_filter():
+    # 5000 rows of a show listing, with start times repeating every 500 rows
+    now = datetime.datetime.now()
+    start_times = [now + datetime.timedelta(hours=i % 500) for i in range(5000)]
+    iso_strings = [start_time.strftime('%Y-%m-%dT%H:%M:%S.%fZ') for start_time in start_times]
+
+    start = time.perf_counter()
+    for value in iso_strings:
+        legacy_format_datetime(value, 'full')
+    legacy = time.perf_counter() - start
+
+    format_datetime.cache_clear()
+    start = time.perf_counter()
+    for value in start_times:
+        format_datetime(value, 'full')
+    current = time.perf_counter() - start
+
+    print('%10s %10s %10s' % ('rows', 'legacy', 'current'))
+    print('%10d %10.3f %10.3f' % (len(start_times), legacy, current))
+
+BENCHMARKS = {
+    'datetime_filter': benchmark_datetime_filter,
+    'venues': benchmark_venues,
+    'show_pages': benchmark_show_pages,
+}
+
+if __name__ == '__main__':
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        with app.app_context():
+            db.create_all()
+        try:
+            BENCHMARKS[name]()
+        finally:
+            with app.app_context():
+                db.drop_all()
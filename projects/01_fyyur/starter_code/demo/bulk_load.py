@@ -0,0 +1,305 @@
+'''
+Bulk loader for partner catalogues.
+
+Streams venues, artists or shows from a CSV file or a JSON lines file (one
+object per line) and inserts them in batches, each batch in its own
+transaction. Run from the starter_code directory:
+
+    python -m demo.bulk_load venues venues.csv
+    python -m demo.bulk_load artists artists.jsonl
+    python -m demo.bulk_load shows shows.csv --batch-size 10000
+
+Columns are named after the model attributes. Shows reference their venue and
+artist either by `venue_id`/`artist_id` or by `venue_name`/`artist_name`; both
+are resolved in memory against the ids and names already in the database, and
+shows referencing unknown entities are skipped. Genres are given as a JSON
+array or a comma-separated string. Times with a UTC offset are converted to
+local time, in which the app keeps them.
+
+Rows the tables would reject, e.g. without a required column, with a time or
+an id that does not parse, or with an id already taken, are skipped and
+reported by row number, so that they do not fail their batch.
+
+The number of input rows committed so far is recorded in the bulk_load_checkpoint
+table in the same transaction as each batch, so re-running a failed load
+resumes right after the last committed batch. The checkpoint is cleared once
+the whole file is loaded.
+'''
+from app import app, db
+from models import Artist, Show, Venue
+from counters import increment_upcoming_shows
+import argparse
+import csv
+import datetime
+import io
+import itertools
+import json
+import os
+import time
+
+BATCH_SIZE = 5000
+# skipped rows reported in detail; the rest are only counted
+MAX_ERRORS = 100
+
+checkpoints = db.Table('bulk_load_checkpoint', db.MetaData(),
+    db.Column('source', db.String, primary_key=True),
+    db.Column('rows', db.Integer, nullable=False)
+)
+
+def read_rows(path):
+    # yields (row dict or None, error or None) per input row without reading
+    # the whole file
+    with open(path, newline='') as f:
+        if path.endswith('.csv'):
+            for row in csv.DictReader(f):
+                yield {key: value for key, value in row.items() if value != ''}, None
+        else:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                except ValueError:
+                    yield None, 'invalid JSON'
+                    continue
+                if not isinstance(row, dict):
+                    yield None, 'expected a JSON object'
+                    continue
+                yield row, None
+
+def parse_int(value):
+    # ints, integral floats and decimal strings; bools are not ids
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        raise ValueError(value)
+    if isinstance(value, float):
+        if not value.is_integer():
+            raise ValueError(value)
+        value = int(value)
+    value = int(value)
+    # ids are 4-byte integers in Postgres
+    if not -2**31 <= value < 2**31:
+        raise ValueError(value)
+    return value
+
+def parse_bool(value):
+    if isinstance(value, str):
+        return value.strip().lower() in ('1', 'true', 'yes', 'y')
+    return bool(value)
+
+def parse_genres(value):
+    if isinstance(value, str):
+        if value.startswith('['):
+            return json.loads(value)
+        return [genre.strip() for genre in value.split(',') if genre.strip()]
+    return value
+
+def parse_datetime(value):
+    # naive local time, as the app compares start times to datetime.now()
+    value = datetime.datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if value.tzinfo is not None:
+        value = value.astimezone().replace(tzinfo=None)
+    return value
+
+def check(column, value):
+    # raises ValueError for a value the column would reject
+    if value is None:
+        # ids come from the sequence, and references are resolved by the loader
+        if not column.nullable and not column.primary_key and not column.foreign_keys:
+            raise ValueError('missing %s' % column.name)
+    elif isinstance(column.type, db.String):
+        if not isinstance(value, str) or '\x00' in value:
+            raise ValueError('invalid %s' % column.name)
+        if column.type.length is not None and len(value) > column.type.length:
+            raise ValueError('%s longer than %d characters' % (column.name, column.type.length))
+    elif isinstance(column.type, db.ARRAY):
+        if not isinstance(value, list) or not all(isinstance(item, str) for item in value):
+            raise ValueError('invalid %s' % column.name)
+
+class Loader(object):
+    # converts input rows of one model into rows for its table
+    model = None
+    columns = []
+    parsers = {}
+
+    def convert(self, row):
+        # every column is set, to None when the row has no value for it, as
+        # a batch goes to one executemany that takes its keys from the first
+        # row. Raises ValueError for a row the table would reject
+        values = {}
+        for column in self.columns:
+            value = row.get(column)
+            parse = self.parsers.get(column)
+            if value is not None and parse is not None:
+                try:
+                    value = parse(value)
+                except (ValueError, TypeError, AttributeError):
+                    raise ValueError('invalid %s' % column)
+            check(self.model.__table__.c[column], value)
+            values[column] = value
+        return values
+
+    def insert(self, rows):
+        db.session.execute(self.model.__table__.insert(), rows)
+
+    def finish(self):
+        pass
+
+class EntityLoader(Loader):
+    parsers = {
+        'id': parse_int,
+        'genres': parse_genres,
+    }
+
+    def __init__(self):
+        # ids already taken, in the database or by earlier rows
+        self.ids = {row[0] for row in db.session.query(self.model.id).yield_per(10000)}
+
+    def convert(self, row):
+        values = Loader.convert(self, row)
+        if values['id'] is not None:
+            if values['id'] in self.ids:
+                raise ValueError('id %d already taken' % values['id'])
+            self.ids.add(values['id'])
+        return values
+
+    def insert(self, rows):
+        # rows without ids take theirs from the id sequence
+        if all(row['id'] is None for row in rows):
+            rows = [dict(row) for row in rows]
+            for row in rows:
+                del row['id']
+        Loader.insert(self, rows)
+
+    def finish(self):
+        # explicit ids bypass the id sequence, so move it past them
+        table = self.model.__tablename__
+        db.session.execute(db.text(
+            'SELECT setval(pg_get_serial_sequence(\'"%s"\', \'id\'), coalesce(max(id), 1)) FROM "%s"' % (table, table)))
+
+class VenueLoader(EntityLoader):
+    model = Venue
+    columns = ['id', 'name', 'genres', 'city', 'state', 'address', 'phone', 'image_link',
+               'facebook_link', 'website', 'seeking_talent', 'seeking_description']
+    parsers = dict(EntityLoader.parsers, seeking_talent=parse_bool)
+
+class ArtistLoader(EntityLoader):
+    model = Artist
+    columns = ['id', 'name', 'genres', 'city', 'state', 'phone', 'image_link',
+               'facebook_link', 'website', 'seeking_venue', 'seeking_description']
+    parsers = dict(EntityLoader.parsers, seeking_venue=parse_bool)
+
+class ShowLoader(Loader):
+    model = Show
+    columns = ['venue_id', 'artist_id', 'start_time']
+    parsers = {
+        'venue_id': parse_int,
+        'artist_id': parse_int,
+        'start_time': parse_datetime,
+    }
+
+    def __init__(self):
+        # id -> id for known ids and name -> id for names, for both entities
+        self.venues = self.load_keys(Venue)
+        self.artists = self.load_keys(Artist)
+
+    @staticmethod
+    def load_keys(model):
+        keys = {}
+        for entity_id, name in db.session.query(model.id, model.name).yield_per(10000):
+            keys[entity_id] = entity_id
+            keys[name] = entity_id
+        return keys
+
+    def convert(self, row):
+        row = dict(row)
+        venue = row.pop('venue_name', None)
+        artist = row.pop('artist_name', None)
+        values = Loader.convert(self, row)
+        values['venue_id'] = self.venues.get(venue if values['venue_id'] is None else values['venue_id'])
+        values['artist_id'] = self.artists.get(artist if values['artist_id'] is None else values['artist_id'])
+        if values['venue_id'] is None or values['artist_id'] is None:
+            return None
+        return values
+
+    def insert(self, rows):
+        connection = db.session.connection().connection
+        cursor = connection.cursor()
+        if hasattr(cursor, 'copy_expert'):
+            # psycopg2: COPY is several times faster than executemany
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            for row in rows:
+                writer.writerow([row['venue_id'], row['artist_id'], row['start_time'].isoformat()])
+            buffer.seek(0)
+            cursor.copy_expert('COPY "Show" (venue_id, artist_id, start_time) FROM STDIN WITH CSV', buffer)
+        else:
+            Loader.insert(self, rows)
+        increment_upcoming_shows(rows)
+
+LOADERS = {
+    'venues': VenueLoader,
+    'artists': ArtistLoader,
+    'shows': ShowLoader,
+}
+
+def load(entity, path, batch_size=BATCH_SIZE):
+    checkpoints.create(db.engine, checkfirst=True)
+    source = '%s:%s' % (entity, os.path.abspath(path))
+    done = db.session.execute(
+        db.select(checkpoints.c.rows).where(checkpoints.c.source == source)).scalar() or 0
+    db.session.commit()
+    if done:
+        print('Resuming %s after %d rows' % (source, done))
+
+    loader = LOADERS[entity]()
+    rows = itertools.islice(read_rows(path), done, None)
+    inserted = skipped = errors = 0
+    start = time.perf_counter()
+    while True:
+        batch = list(itertools.islice(rows, batch_size))
+        if not batch:
+            break
+        values = []
+        for number, (row, error) in enumerate(batch, done + 1):
+            value = None
+            if error is None:
+                try:
+                    value = loader.convert(row)
+                except ValueError as err:
+                    error = str(err)
+            if error is not None:
+                if errors < MAX_ERRORS:
+                    print('Row %d skipped: %s' % (number, error))
+                errors += 1
+            if value is not None:
+                values.append(value)
+        skipped += len(batch) - len(values)
+        done += len(batch)
+        try:
+            if values:
+                loader.insert(values)
+            statement = db.update(checkpoints).where(checkpoints.c.source == source).values(rows=done)
+            if db.session.execute(statement).rowcount == 0:
+                db.session.execute(db.insert(checkpoints).values(source=source, rows=done))
+            db.session.commit()
+        except:
+            db.session.rollback()
+            print('Batch ending at row %d failed; re-run to resume.' % done)
+            raise
+        inserted += len(values)
+        elapsed = time.perf_counter() - start
+        print('%d rows inserted, %d skipped, %.0f rows/sec' % (inserted, skipped, inserted / elapsed))
+
+    loader.finish()
+    db.session.execute(db.delete(checkpoints).where(checkpoints.c.source == source))
+    db.session.commit()
+    return inserted, skipped
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Bulk load Fyyur data from CSV or JSON lines.')
+    parser.add_argument('entity', choices=sorted(LOADERS))
+    parser.add_argument('path')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    args = parser.parse_args()
+    with app.app_context():
+        load(args.entity, args.path, args.batch_size)
@@ -1,5 +1,6 @@
 from app import db
 from models import Artist, Show, Venue
+from counters import refresh_upcoming_shows
 from sqlalchemy import exc
 from sqlalchemy.types import DateTime
 import datetime
@@ -278,4 +279,7 @@ def populate_shows():
 
 populate_venues()
 populate_artists()
-populate_shows()
\ No newline at end of file
+populate_shows()
+# shows are inserted directly, so the upcoming show counters are rebuilt once
+refresh_upcoming_shows()
+db.session.commit()
\ No newline at end of file
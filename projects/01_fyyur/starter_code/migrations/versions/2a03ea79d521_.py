@@ -0,0 +1,30 @@
+"""indexes for the show, venue and artist listings
+
+Revision ID: 2a03ea79d521
+Revises: 73407c1f293f
+Create Date: 2026-10-18 11:27:08.551903
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2a03ea79d521'
+down_revision = '73407c1f293f'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_show_venue_id_start_time', 'Show', ['venue_id', 'start_time'], unique=False)
+    op.create_index('ix_show_artist_id_start_time', 'Show', ['artist_id', 'start_time'], unique=False)
+    op.create_index('ix_show_start_time_id', 'Show', ['start_time', 'id'], unique=False)
+    op.create_index('ix_venue_state_city_id', 'Venue', ['state', 'city', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_venue_state_city_id', table_name='Venue')
+    op.drop_index('ix_show_start_time_id', table_name='Show')
+    op.drop_index('ix_show_artist_id_start_time', table_name='Show')
+    op.drop_index('ix_show_venue_id_start_time', table_name='Show')
@@ -0,0 +1,28 @@
+"""time of the last upcoming show counter roll-over
+
+Revision ID: 5b8d0e3c9a14
+Revises: 2a03ea79d521
+Create Date: 2026-10-18 21:42:10.218530
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5b8d0e3c9a14'
+down_revision = '2a03ea79d521'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('counter_rollover',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('rolled_over_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade():
+    op.drop_table('counter_rollover')
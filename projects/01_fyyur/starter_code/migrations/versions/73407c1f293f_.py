@@ -0,0 +1,39 @@
+"""upcoming show counters on Venue and Artist
+
+Revision ID: 73407c1f293f
+Revises: 8c275aab463a
+Create Date: 2026-10-18 10:03:54.918270
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '73407c1f293f'
+down_revision = '8c275aab463a'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('Venue', sa.Column('num_upcoming_shows', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('Artist', sa.Column('num_upcoming_shows', sa.Integer(), server_default='0', nullable=False))
+    # backfill from the existing shows
+    op.execute('''
+        UPDATE "Venue" SET num_upcoming_shows = (
+            SELECT count(*) FROM "Show"
+            WHERE "Show".venue_id = "Venue".id AND "Show".start_time > now()
+        )
+    ''')
+    op.execute('''
+        UPDATE "Artist" SET num_upcoming_shows = (
+            SELECT count(*) FROM "Show"
+            WHERE "Show".artist_id = "Artist".id AND "Show".start_time > now()
+        )
+    ''')
+
+
+def downgrade():
+    op.drop_column('Artist', 'num_upcoming_shows')
+    op.drop_column('Venue', 'num_upcoming_shows')
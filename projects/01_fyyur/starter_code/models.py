@@ -3,9 +3,17 @@
 #----------------------------------------------------------------------------#
 
 from app import db
+from sqlalchemy import DDL, event
+
+# the trigram indexes used by search need the pg_trgm extension
+event.listen(db.metadata, 'before_create', DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm').execute_if(dialect='postgresql'))
 
 class Venue(db.Model):
     __tablename__ = 'Venue'
+    __table_args__ = (
+        db.Index('ix_venue_name_trgm', 'name', postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'}),
+        db.Index('ix_venue_state_city_id', 'state', 'city', 'id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True, nullable=False)
     name = db.Column(db.String, nullable=False)
@@ -19,10 +27,14 @@ class Venue(db.Model):
     website = db.Column(db.String, nullable=True)
     seeking_talent = db.Column(db.Boolean, nullable=False)
     seeking_description = db.Column(db.String, nullable=True)
-    shows = db.relationship('Show', backref='venue', lazy='joined', cascade="all, delete")
+    num_upcoming_shows = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    shows = db.relationship('Show', backref='venue', lazy='select', cascade="all, delete")
 
 class Artist(db.Model):
     __tablename__ = 'Artist'
+    __table_args__ = (
+        db.Index('ix_artist_name_trgm', 'name', postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'}),
+    )
 
     id = db.Column(db.Integer, primary_key=True, nullable=False)
     name = db.Column(db.String, nullable=False)
@@ -35,12 +47,25 @@ class Artist(db.Model):
     website = db.Column(db.String, nullable=True)
     seeking_venue = db.Column(db.Boolean, nullable=False)
     seeking_description = db.Column(db.String, nullable=True)
-    shows = db.relationship('Show', backref='artist', lazy='joined', cascade="all, delete")
+    num_upcoming_shows = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    shows = db.relationship('Show', backref='artist', lazy='select', cascade="all, delete")
 
 class Show(db.Model):
     __tablename__ = 'Show'
+    __table_args__ = (
+        db.Index('ix_show_venue_id_start_time', 'venue_id', 'start_time'),
+        db.Index('ix_show_artist_id_start_time', 'artist_id', 'start_time'),
+        db.Index('ix_show_start_time_id', 'start_time', 'id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True, nullable=False)
     venue_id = db.Column(db.Integer, db.ForeignKey('Venue.id'), nullable=False)
     artist_id = db.Column(db.Integer, db.ForeignKey('Artist.id'), nullable=False)
-    start_time = db.Column(db.DateTime, nullable=False)
\ No newline at end of file
+    start_time = db.Column(db.DateTime, nullable=False)
+class CounterRollover(db.Model):
+    # a single row recording up to when the upcoming show counters were
+    # rolled over, see counters.py
+    __tablename__ = 'counter_rollover'
+
+    id = db.Column(db.Integer, primary_key=True, nullable=False)
+    rolled_over_at = db.Column(db.DateTime, nullable=False)
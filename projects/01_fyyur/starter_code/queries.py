@@ -0,0 +1,151 @@
+#----------------------------------------------------------------------------#
+# Queries.
+#----------------------------------------------------------------------------#
+
+import base64
+import bisect
+import datetime
+import itertools
+import json
+import time
+from flask import abort, current_app, g, request
+from sqlalchemy import event
+from sqlalchemy.orm import load_only, raiseload, selectinload
+from app import db
+from models import Artist, Venue, Show
+
+def venue_areas(rows):
+  # groups a page of venue rows ordered by (state, city, id) into the areas
+  # of the /venues page
+  for (city, state), venues in itertools.groupby(rows, lambda row: (row.city, row.state)):
+    yield {
+      'city': city,
+      'state': state,
+      'venues': [{
+        'id': venue.id,
+        'name': venue.name,
+        'num_upcoming_shows': venue.num_upcoming_shows
+      } for venue in venues]
+    }
+
+def encode_cursor(values):
+  return base64.urlsafe_b64encode(json.dumps(values, default=datetime.datetime.isoformat).encode()).decode()
+
+def cursor_value(value, column):
+  # the value decoded from a cursor for `column`, checked against the column
+  # type so that a tampered cursor is a 400 rather than a database error
+  if isinstance(column.type, db.DateTime) and isinstance(value, str):
+    return datetime.datetime.fromisoformat(value)
+  if isinstance(column.type, db.Integer) and isinstance(value, int) and not isinstance(value, bool):
+    # ids are 4-byte integers in Postgres
+    if -2**31 <= value < 2**31:
+      return value
+  if isinstance(column.type, db.String) and isinstance(value, str) and '\x00' not in value:
+    return value
+  raise ValueError(value)
+
+def decode_cursor(cursor, columns):
+  try:
+    values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    if not isinstance(values, list) or len(values) != len(columns):
+      raise ValueError(cursor)
+    return [cursor_value(value, column) for value, column in zip(values, columns)]
+  except (ValueError, TypeError):
+    abort(400)
+
+def pagination_args():
+  # (cursor, page size) from the query string, e.g. /shows?cursor=...&limit=20
+  page_size = request.args.get('limit', current_app.config['PAGE_SIZE'], type=int)
+  return request.args.get('cursor'), min(max(page_size, 1), current_app.config['MAX_PAGE_SIZE'])
+
+def keyset_page(query, order_by, cursor, page_size):
+  # one page of `query` ordered by the `order_by` columns, starting after the
+  # row encoded in `cursor`. Returns (rows, next_cursor), next_cursor being
+  # None on the last page. The row comparison is served by the index on the
+  # `order_by` columns, so every page costs the same
+  if cursor:
+    query = query.filter(db.tuple_(*order_by) > db.tuple_(*decode_cursor(cursor, order_by)))
+  rows = query.order_by(*order_by).limit(page_size + 1).all()
+  next_cursor = None
+  if len(rows) > page_size:
+    rows = rows[:page_size]
+    next_cursor = encode_cursor([getattr(rows[-1], column.key) for column in order_by])
+  return rows, next_cursor
+
+_count_cache = {}
+
+def cached_count(model):
+  # exact row count, recomputed at most every COUNT_CACHE_SECONDS
+  now = time.monotonic()
+  count, expires = _count_cache.get(model.__tablename__, (None, 0))
+  if now >= expires:
+    count = db.session.query(db.func.count(model.id)).scalar()
+    _count_cache[model.__tablename__] = (count, now + current_app.config['COUNT_CACHE_SECONDS'])
+  return count
+
+def load_related(model, ids):
+  # resolves Artist/Venue ids to (id, name, image_link) rows through a
+  # per-request identity map, fetching every id not seen yet with one IN query
+  if 'identity_map' not in g:
+    g.identity_map = {}
+  identity_map = g.identity_map.setdefault(model.__tablename__, {})
+  missing = set(ids).difference(identity_map)
+  if missing:
+    rows = db.session.query(model.id, model.name, model.image_link).filter(model.id.in_(missing))
+    for row in rows:
+      identity_map[row.id] = row
+  return identity_map
+
+def show_partners(column, partner_column, entity_id):
+  # ids of the artists who played a venue, or of the venues an artist played
+  return {row[0] for row in db.session.query(partner_column).filter(column == entity_id).distinct()}
+
+def split_shows(column, entity_id, now=None):
+  # fetches the shows of a venue or artist in one query ordered by start_time
+  # and partitions them at `now` into (past_shows, upcoming_shows)
+  now = now or datetime.datetime.now()
+  shows = db.session.query(Show.venue_id, Show.artist_id, Show.start_time).filter(
+    column == entity_id).order_by(Show.start_time).all()
+  split = bisect.bisect_right([show.start_time for show in shows], now)
+  return shows[:split], shows[split:]
+
+# Loader options. Venue.shows and Artist.shows are lazy, so each view states
+# up front what it needs from them: nothing, or only their keys.
+
+def without_shows(model):
+  # a venue or artist on its own; reading .shows raises instead of quietly
+  # issuing another query
+  return raiseload(model.shows)
+
+def with_show_keys(model):
+  # a venue or artist with the keys of its shows, fetched with one more
+  # query, e.g. to delete it together with its shows
+  return selectinload(model.shows).options(load_only(Show.id, Show.venue_id, Show.artist_id), raiseload('*'))
+
+def search(model, search_term):
+  # partial, case-insensitive and typo-tolerant name search served by the
+  # trigram indexes, ranked by word similarity. % and _ in the term match
+  # themselves, not any name
+  pattern = '%{}%'.format(search_term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_'))
+  rank = db.func.word_similarity(search_term, model.name)
+  return db.session.query(model.id, model.name, model.num_upcoming_shows).filter(db.or_(
+    model.name.ilike(pattern, escape='\\'),
+    model.name.op('%>')(search_term)
+  )).order_by(rank.desc(), model.name).all()
+
+class QueryCounter(object):
+  # counts the statements sent to the database while the block is active,
+  # e.g. `with QueryCounter() as counter: client.get('/venues')`
+  def __init__(self, engine=None):
+    self.engine = engine or db.engine
+    self.count = 0
+
+  def _before_cursor_execute(self, *args, **kwargs):
+    self.count += 1
+
+  def __enter__(self):
+    event.listen(self.engine, 'before_cursor_execute', self._before_cursor_execute)
+    return self
+
+  def __exit__(self, *exc_info):
+    event.remove(self.engine, 'before_cursor_execute', self._before_cursor_execute)
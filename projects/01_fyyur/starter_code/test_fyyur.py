@@ -0,0 +1,324 @@
+import base64
+import datetime
+import json
+import os
+import tempfile
+import unittest
+
+# the tests create and drop their own tables, so they never run against the
+# development database
+os.environ['DATABASE_URL'] = os.environ.get('TEST_DATABASE_URL', 'postgresql://yeo@localhost:5432/fyyur_test')
+
+from sqlalchemy import event
+from app import app, db, page_cache
+from cache import LocalBackend, PageCache
+from models import Artist, CounterRollover, Show, Venue
+from queries import QueryCounter, _count_cache
+from demo.benchmark import seed
+from demo import bulk_load
+import counters
+
+
+class SeededTestCase(unittest.TestCase):
+    """Seeds 200 venues and artists with three shows each for the class"""
+
+    @classmethod
+    def setUpClass(cls):
+        with app.app_context():
+            db.create_all()
+        seed(200, 1)
+        with app.app_context():
+            db.session.execute(db.text('ANALYZE'))
+            db.session.commit()
+
+    @classmethod
+    def tearDownClass(cls):
+        with app.app_context():
+            db.session.close()
+            db.drop_all()
+
+    def setUp(self):
+        self.client = app.test_client()
+        page_cache.clear()
+        _count_cache.clear()
+
+
+class QueryPlanTestCase(SeededTestCase):
+    """Runs EXPLAIN on every statement of the hot routes against a seeded
+    database and fails if any of them falls back to a sequential scan"""
+
+    def explain(self, path, data=None):
+        statements = []
+
+        def capture(conn, cursor, statement, parameters, context, executemany):
+            statements.append((statement, parameters))
+
+        with app.app_context():
+            event.listen(db.engine, 'before_cursor_execute', capture)
+            try:
+                if data is None:
+                    res = self.client.get(path)
+                else:
+                    res = self.client.post(path, data=data)
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', capture)
+            self.assertEqual(res.status_code, 200)
+            self.assertTrue(statements)
+
+            plans = []
+            with db.engine.connect() as connection:
+                # with sequential scans priced out, the planner only picks
+                # one when no index can serve the query
+                connection.exec_driver_sql('SET enable_seqscan = off')
+                for statement, parameters in statements:
+                    rows = connection.exec_driver_sql('EXPLAIN ' + statement, parameters)
+                    plans.append('\n'.join(row[0] for row in rows))
+        return plans
+
+    def assertIndexed(self, path, indexes, data=None):
+        # `indexes` names, for every statement the route sends in order, the
+        # index that must serve it, or None for any index. A Filter line
+        # means rows were read from the index that the condition then threw
+        # away, i.e. the named index did not cover the condition
+        plans = self.explain(path, data)
+        self.assertEqual(len(plans), len(indexes), plans)
+        for plan, index in zip(plans, indexes):
+            self.assertNotIn('Seq Scan', plan, plan)
+            if index is not None:
+                self.assertIn(index, plan)
+                self.assertNotIn('Filter:', plan, plan)
+
+    def test_venues_plan(self):
+        # the page and the total
+        self.assertIndexed('/venues', ['ix_venue_state_city_id', None])
+
+    def test_venues_next_page_plan(self):
+        res = self.client.get('/venues?limit=10')
+        cursor = res.data.decode().split('cursor=')[1].split('&')[0]
+        self.assertIndexed('/venues?limit=10&cursor=' + cursor, ['ix_venue_state_city_id'])
+
+    def test_artists_plan(self):
+        self.assertIndexed('/artists', ['"Artist_pkey"', None])
+
+    def test_shows_plan(self):
+        # the page, its venues, its artists and the total
+        self.assertIndexed('/shows', ['ix_show_start_time_id', '"Venue_pkey"', '"Artist_pkey"', None])
+
+    def test_show_venue_plan(self):
+        # the venue, its shows and their artists
+        self.assertIndexed('/venues/3', ['"Venue_pkey"', 'ix_show_venue_id_start_time', '"Artist_pkey"'])
+
+    def test_show_artist_plan(self):
+        self.assertIndexed('/artists/3', ['"Artist_pkey"', 'ix_show_artist_id_start_time', '"Venue_pkey"'])
+
+    def test_search_venues_plan(self):
+        self.assertIndexed('/venues/search', ['ix_venue_name_trgm'], data={'search_term': 'Venue 1'})
+
+    def test_search_artists_plan(self):
+        self.assertIndexed('/artists/search', ['ix_artist_name_trgm'], data={'search_term': 'Artist 1'})
+
+
+class QueryCountTestCase(SeededTestCase):
+    """Counts the statements each route sends to the database, which must not
+    grow with the number of rows or shows involved"""
+
+    def assertQueries(self, count, path, data=None, status_code=200):
+        with app.app_context(), QueryCounter() as counter:
+            if data is None:
+                res = self.client.get(path)
+            else:
+                res = self.client.post(path, data=data)
+        self.assertEqual(res.status_code, status_code)
+        self.assertEqual(counter.count, count)
+
+    def test_venues_queries(self):
+        # the page and the total
+        self.assertQueries(2, '/venues')
+
+    def test_artists_queries(self):
+        self.assertQueries(2, '/artists')
+
+    def test_shows_queries(self):
+        # the page, its venues, its artists and the total
+        self.assertQueries(4, '/shows')
+
+    def test_show_venue_queries(self):
+        # the venue, its shows and their artists
+        self.assertQueries(3, '/venues/3')
+
+    def test_show_artist_queries(self):
+        self.assertQueries(3, '/artists/3')
+
+    def test_edit_venue_queries(self):
+        self.assertQueries(1, '/venues/3/edit')
+
+    def test_edit_artist_queries(self):
+        self.assertQueries(1, '/artists/3/edit')
+
+    def test_search_venues_queries(self):
+        self.assertQueries(1, '/venues/search', data={'search_term': 'Venue 1'})
+
+    def test_search_artists_queries(self):
+        self.assertQueries(1, '/artists/search', data={'search_term': 'Artist 1'})
+
+    def test_search_wildcards(self):
+        # the wildcards of LIKE match only themselves
+        for term in ['%', '_', '\\', 'Venue%1']:
+            res = self.client.post('/venues/search', data={'search_term': term})
+            self.assertEqual(res.status_code, 200)
+            self.assertIn(b': 0</h3>', res.data, term)
+
+    def test_delete_venue_queries(self):
+        # the venue, the keys of its shows, the two deletes and the artist
+        # counters
+        self.assertQueries(5, '/venues/200', data={})
+        with app.app_context():
+            self.assertEqual(Show.query.filter(Show.venue_id == 200).count(), 0)
+
+
+class RolloverTestCase(SeededTestCase):
+    """Rolls the upcoming show counters over across gaps between runs"""
+
+    def test_gap_longer_than_an_hour(self):
+        start = datetime.datetime.now()
+        show = {'venue_id': 5, 'artist_id': 5, 'start_time': start + datetime.timedelta(hours=2)}
+        with app.app_context():
+            # the first run rebuilds every counter
+            self.assertIsNone(counters.roll_over_since_last_run(start))
+            db.session.add(Show(**show))
+            counters.increment_upcoming_shows([show], start)
+            db.session.commit()
+            self.assertEqual(counters.check_upcoming_shows(start), [])
+
+            # no run for three hours: the show started in the gap
+            later = start + datetime.timedelta(hours=3)
+            self.assertNotEqual(counters.check_upcoming_shows(later), [])
+            self.assertGreaterEqual(counters.roll_over_since_last_run(later), 1)
+            db.session.commit()
+
+            self.assertEqual(counters.check_upcoming_shows(later), [])
+            self.assertEqual(db.session.get(CounterRollover, 1).rolled_over_at, later)
+
+
+class CursorTestCase(SeededTestCase):
+    """Sends cursors that do not decode to values of the page columns"""
+
+    def cursor(self, values):
+        return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+    def test_cursor_of_each_page(self):
+        res = self.client.get('/shows?limit=10')
+        cursor = res.data.decode().split('cursor=')[1].split('&')[0]
+        self.assertEqual(self.client.get('/shows?limit=10&cursor=' + cursor).status_code, 200)
+
+    def test_bad_cursors(self):
+        for path, values in [
+            ('/artists', ['abc']),
+            ('/artists', [True]),
+            ('/artists', [2.5]),
+            ('/artists', [2**40]),
+            ('/artists', {'id': 3}),
+            ('/artists', [[3]]),
+            ('/artists', [3, 4]),
+            ('/venues', ['TX', 'Austin', '3']),
+            ('/venues', [1, 'Austin', 3]),
+            ('/venues', ['TX', 'Aus\x00tin', 3]),
+            ('/shows', [12, 3]),
+            ('/shows', ['tomorrow', 3]),
+            ('/shows', [None, 3]),
+        ]:
+            res = self.client.get(path + '?cursor=' + self.cursor(values))
+            self.assertEqual(res.status_code, 400, (path, values))
+
+
+class BulkLoadTestCase(SeededTestCase):
+    """Loads partner catalogues with the bulk loader"""
+
+    def load(self, entity, content, suffix='.csv'):
+        with tempfile.NamedTemporaryFile('w', suffix=suffix, delete=False) as f:
+            f.write(content)
+        try:
+            with app.app_context():
+                return bulk_load.load(entity, f.name)
+        finally:
+            os.remove(f.name)
+
+    def setUp(self):
+        super().setUp()
+        with app.app_context():
+            # the seeded ids bypassed the id sequence
+            bulk_load.VenueLoader().finish()
+            db.session.commit()
+
+    def test_rows_with_empty_cells(self):
+        # optional columns are empty in some rows only, in either order
+        header = 'name,genres,city,state,address,phone,website,seeking_talent,seeking_description\n'
+        self.assertEqual(self.load('venues', header +
+            'Bulk Venue 1,Jazz,Austin,TX,1 Main St,555-0101,https://one.example,false,\n'
+            'Bulk Venue 2,Jazz,Austin,TX,2 Main St,555-0102,,true,Looking\n'
+            'Bulk Venue 3,Jazz,Austin,TX,3 Main St,555-0103,https://three.example,false,\n'), (3, 0))
+
+        with app.app_context():
+            venues = {venue.name: venue for venue in Venue.query.filter(Venue.name.like('Bulk Venue %'))}
+            self.assertEqual(venues['Bulk Venue 1'].website, 'https://one.example')
+            self.assertIsNone(venues['Bulk Venue 2'].website)
+            self.assertEqual(venues['Bulk Venue 2'].seeking_description, 'Looking')
+            self.assertEqual(venues['Bulk Venue 3'].website, 'https://three.example')
+            self.assertIsNone(venues['Bulk Venue 3'].seeking_description)
+
+    def test_shows_by_name_and_id(self):
+        self.assertEqual(self.load('shows',
+            '{"venue_name": "Venue 1", "artist_id": 2, "start_time": "2030-01-01T20:00:00"}\n'
+            '{"venue_id": 2, "artist_name": "Artist 1", "start_time": "2030-01-02T20:00:00"}\n',
+            suffix='.jsonl'), (2, 0))
+
+    def test_bad_rows_skipped(self):
+        # every bad row is skipped in the same batch as good ones, and the
+        # load completes
+        self.assertEqual(self.load('shows',
+            '{"venue_id": 3, "artist_id": 3, "start_time": "2031-01-01T20:00:00"}\n'
+            '{"venue_id": 3, "artist_id": 3, "start_time": "next friday"}\n'
+            '{"venue_id": 3, "artist_id": 3}\n'
+            '{"venue_id": "three", "artist_id": 3, "start_time": "2031-01-02T20:00:00"}\n'
+            '{"venue_id": true, "artist_id": 3, "start_time": "2031-01-02T20:00:00"}\n'
+            'not json\n'
+            '[3, 3]\n'
+            '{"venue_id": 3, "artist_id": 3, "start_time": "2031-01-03T20:00:00"}\n',
+            suffix='.jsonl'), (2, 6))
+        header = 'id,name,genres,city,state,address,phone,seeking_talent\n'
+        self.assertEqual(self.load('venues', header +
+            ',,Jazz,Austin,TX,1 Main St,555-0101,false\n'
+            '3,Taken Venue,Jazz,Austin,TX,1 Main St,555-0101,false\n'
+            ',Long Venue,Jazz,Austin,%s,1 Main St,555-0101,false\n' % ('T' * 121) +
+            ',Good Venue,Jazz,Austin,TX,1 Main St,555-0101,false\n'), (1, 3))
+        with app.app_context():
+            self.assertEqual(Venue.query.filter(Venue.name == 'Good Venue').count(), 1)
+            self.assertEqual(db.session.execute(db.select(bulk_load.checkpoints)).all(), [])
+
+    def test_times_with_offset(self):
+        local = datetime.datetime(2031, 6, 1, 18, 0, tzinfo=datetime.timezone.utc).astimezone().replace(tzinfo=None)
+        for value in ['2031-06-01T20:00:00+02:00', '2031-06-01T18:00:00Z']:
+            self.assertEqual(bulk_load.parse_datetime(value), local)
+        self.assertEqual(bulk_load.parse_datetime('2031-06-01T20:00:00'), datetime.datetime(2031, 6, 1, 20, 0))
+
+
+class PageCacheTestCase(unittest.TestCase):
+    """Versioned page keys, with and without a shared backend"""
+
+    def test_page_rendered_across_a_write_not_served(self):
+        for backend in [None, LocalBackend()]:
+            cache = PageCache(backend=backend)
+            # the key is taken before the page's data is read, then a write
+            # commits and invalidates the page before it is stored
+            key = cache.key('venue', 1)
+            cache.invalidate('venue', 1)
+            cache.set(key, 'stale page')
+
+            self.assertIsNone(cache.get(cache.key('venue', 1)))
+            cache.set(cache.key('venue', 1), 'page')
+            self.assertEqual(cache.get(cache.key('venue', 1)), 'page')
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,326 @@
+'''
+Benchmarks for the Trivia API.
+
+endpoints:      seeds --size questions and drives every endpoint, through the
+                Flask test client and through a real WSGI server on a local
+                port, reporting throughput, p50/p99 latency and SQL statements
+                per request
+pages:          seeds a growing number of questions and, at every size, times
+                GET /questions on a few pages and counts the statements each
+                request sends to the database
+serialization:  times turning 10k questions into a JSON response, through
+                Question.format() and jsonify, and through the column
+                projection and json_response used by the endpoints
+
+Run from the backend directory against a scratch database; the tables are
+dropped afterwards. A SQLite file stands in when Postgres is not at hand,
+without the trigram search ranking:
+
+    createdb trivia_bench
+    python benchmark.py --database postgresql://localhost:5432/trivia_bench [endpoints] [pages] [serialization]
+    python benchmark.py --database sqlite:////tmp/trivia_bench.db endpoints --output before.json
+
+With --output, the results are also written as JSON, along with the commit
+they were measured on, so that runs can be diffed across commits.
+'''
+import argparse
+import datetime
+import http.client
+import json
+import logging
+import platform
+import statistics
+import subprocess
+import threading
+import time
+from flask import jsonify
+from sqlalchemy import event
+from werkzeug.serving import make_server
+
+from flaskr import create_app, json_response, orjson
+from models import db, Question, Category
+
+SIZES = [1000, 10000, 100000]
+PAGES = [1, 10, 100]
+REPEAT = 20
+CHUNK = 10000
+SERIALIZED_ROWS = 10000
+ENDPOINT_SIZE = 10000
+ENDPOINT_REQUESTS = 200
+
+
+def seed(start, stop):
+  # inserts questions [start, stop) in chunks of CHUNK rows
+  for chunk in range(start, stop, CHUNK):
+    db.session.execute(Question.__table__.insert(), [{
+      'question': 'Question {}'.format(i),
+      'answer': 'Answer {}'.format(i),
+      'category': i % 6 + 1,
+      'difficulty': i % 5 + 1
+    } for i in range(chunk, min(chunk + CHUNK, stop))])
+    db.session.commit()
+  # rows inserted behind the model's back leave its caches stale
+  Question.clear_cache()
+
+
+class StatementCounter(object):
+  # counts the statements sent to the database while the block is active,
+  # from any thread
+  def __init__(self):
+    self.count = 0
+
+  def _before_cursor_execute(self, *args):
+    self.count += 1
+
+  def __enter__(self):
+    event.listen(db.engine, 'before_cursor_execute', self._before_cursor_execute)
+    return self
+
+  def __exit__(self, *exc_info):
+    event.remove(db.engine, 'before_cursor_execute', self._before_cursor_execute)
+
+
+def measure(client, path):
+  # (statements per request, median milliseconds per request)
+  timings = []
+  with StatementCounter() as counter:
+    for i in range(REPEAT):
+      start = time.perf_counter()
+      res = client.get(path)
+      timings.append((time.perf_counter() - start) * 1000)
+      assert res.status_code == 200, (path, res.status_code)
+  return counter.count // REPEAT, statistics.median(timings)
+
+
+class TestClientDriver(object):
+  # requests go straight to the app, in this thread
+  name = 'test_client'
+
+  def __init__(self, app):
+    self.client = app.test_client()
+
+  def request(self, method, path, body=None):
+    res = self.client.open(path, method=method, json=body)
+    return res.status_code, res.get_data()
+
+  def close(self):
+    pass
+
+
+class ServerDriver(object):
+  # requests go over HTTP to a threaded werkzeug server on a free local port
+  name = 'server'
+
+  def __init__(self, app):
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    self.server = make_server('127.0.0.1', 0, app, threaded=True)
+    self.thread = threading.Thread(target=self.server.serve_forever)
+    self.thread.daemon = True
+    self.thread.start()
+
+  def request(self, method, path, body=None):
+    connection = http.client.HTTPConnection('127.0.0.1', self.server.server_port)
+    try:
+      headers = {}
+      if body is not None:
+        body = json.dumps(body)
+        headers['Content-Type'] = 'application/json'
+      connection.request(method, path, body=body, headers=headers)
+      res = connection.getresponse()
+      return res.status, res.read()
+    finally:
+      connection.close()
+
+  def close(self):
+    self.server.shutdown()
+    self.thread.join()
+
+
+def endpoints(size):
+  # [(name, request factory, number of requests or None for the default)].
+  # A factory returns (method, path, body) for the i-th request
+  created = []
+  quiz = {}
+
+  def create(i):
+    return 'POST', '/questions', {'question': 'Benchmark question {}'.format(i),
+                                  'answer': 'Answer', 'category': 1, 'difficulty': 1}
+
+  def delete(i):
+    # the questions created by create_question, which runs first
+    return 'DELETE', '/questions/{}'.format(created.pop()), None
+
+  def quiz_session(i):
+    return 'POST', '/quizzes', {'quiz_session': quiz.get('token'), 'quiz_category': 'Category 1'}
+
+  last_page = (size - 1) // 10 + 1
+  return [
+    ('categories', lambda i: ('GET', '/categories', None), None),
+    ('questions_first_page', lambda i: ('GET', '/questions?page=1', None), None),
+    ('questions_last_page', lambda i: ('GET', '/questions?page={}'.format(last_page), None), None),
+    ('category_questions', lambda i: ('GET', '/categories/1/questions?page=2', None), None),
+    ('search', lambda i: ('POST', '/questions', {'searchTerm': 'Question {}'.format(i)}), None),
+    ('quiz_start', lambda i: ('POST', '/quizzes', {'previous_questions': [], 'quiz_category': 'Category 1'}), None),
+    ('quiz_session', quiz_session, None),
+    ('create_question', create, None),
+    ('delete_question', delete, None),
+    ('export', lambda i: ('GET', '/questions/export', None), 3),
+  ], created, quiz
+
+
+def run_endpoints(driver, size, requests):
+  # {endpoint: {requests, throughput, p50_ms, p99_ms, queries}}
+  results = {}
+  requests_made, created, quiz = endpoints(size)
+  for name, make_request, count in requests_made:
+    count = count or requests
+    timings = []
+    with StatementCounter() as counter:
+      start = time.perf_counter()
+      for i in range(count):
+        method, path, body = make_request(i)
+        request_start = time.perf_counter()
+        status, data = driver.request(method, path, body)
+        timings.append((time.perf_counter() - request_start) * 1000)
+        assert status == 200, (name, status, data[:200])
+        if name == 'create_question':
+          created.append(json.loads(data)['created'])
+        elif name.startswith('quiz'):
+          quiz['token'] = json.loads(data)['quiz_session']
+      elapsed = time.perf_counter() - start
+    percentiles = statistics.quantiles(timings, n=100, method='inclusive')
+    results[name] = {
+      'requests': count,
+      'throughput': round(count / elapsed, 1),
+      'p50_ms': round(statistics.median(timings), 3),
+      'p99_ms': round(percentiles[98], 3),
+      'queries': round(counter.count / count, 2)
+    }
+  return results
+
+
+def benchmark_endpoints(app, args):
+  seed(0, args.size)
+  results = {}
+  for driver_class in [TestClientDriver, ServerDriver]:
+    driver = driver_class(app)
+    try:
+      results[driver.name] = run_endpoints(driver, args.size, args.requests)
+    finally:
+      driver.close()
+    print('{} questions, {}'.format(args.size, driver.name))
+    print('{:>22} {:>10} {:>9} {:>9} {:>8}'.format('endpoint', 'req/s', 'p50 ms', 'p99 ms', 'queries'))
+    for name, result in results[driver.name].items():
+      print('{:>22} {:>10.1f} {:>9.2f} {:>9.2f} {:>8.2f}'.format(
+        name, result['throughput'], result['p50_ms'], result['p99_ms'], result['queries']))
+  return results
+
+
+def benchmark_pages(app, args):
+  client = app.test_client()
+  results = []
+  seeded = 0
+  print('{:>10} {:>6} {:>8} {:>8}'.format('questions', 'page', 'queries', 'ms'))
+  for size in sorted(args.sizes):
+    seed(seeded, size)
+    seeded = size
+    for page in PAGES:
+      if (page - 1) * 10 < size:
+        queries, ms = measure(client, '/questions?page={}'.format(page))
+        results.append({'questions': size, 'page': page, 'queries': queries, 'ms': round(ms, 3)})
+        print('{:>10} {:>6} {:>8} {:>8.2f}'.format(size, page, queries, ms))
+  return results
+
+
+def benchmark_serialization(app, args):
+  seed(0, SERIALIZED_ROWS)
+  query = Question.query.order_by(Question.id)
+
+  def orm_objects():
+    return jsonify({'questions': [question.format() for question in query]})
+
+  def projection():
+    rows = query.with_entities(*Question.projection())
+    return jsonify({'questions': [Question.format_row(row) for row in rows]})
+
+  def projection_json_response():
+    rows = query.with_entities(*Question.projection())
+    return json_response({'questions': [Question.format_row(row) for row in rows]})
+
+  paths = [('format() + jsonify', orm_objects), ('projection + jsonify', projection)]
+  if orjson is not None:
+    paths.append(('projection + orjson', projection_json_response))
+  results = {}
+  print('{:>24} {:>8}'.format('{} rows'.format(SERIALIZED_ROWS), 'ms'))
+  with app.test_request_context():
+    for name, serialize in paths:
+      timings = []
+      for i in range(REPEAT // 4):
+        start = time.perf_counter()
+        serialize().get_data()
+        timings.append((time.perf_counter() - start) * 1000)
+        db.session.rollback()
+      results[name] = round(statistics.median(timings), 3)
+      print('{:>24} {:>8.1f}'.format(name, results[name]))
+  return results
+
+
+BENCHMARKS = {
+  'endpoints': benchmark_endpoints,
+  'pages': benchmark_pages,
+  'serialization': benchmark_serialization,
+}
+
+
+def commit():
+  try:
+    return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+  except (OSError, subprocess.CalledProcessError):
+    return None
+
+
+def main():
+  parser = argparse.ArgumentParser(description='Benchmark the Trivia API against a scratch database.')
+  parser.add_argument('benchmarks', nargs='*', help='any of {}; all by default'.format(', '.join(sorted(BENCHMARKS))))
+  parser.add_argument('--database', default='postgresql://localhost:5432/trivia_bench')
+  parser.add_argument('--sizes', type=int, nargs='+', default=SIZES, help='question counts for pages')
+  parser.add_argument('--size', type=int, default=ENDPOINT_SIZE, help='question count for endpoints')
+  parser.add_argument('--requests', type=int, default=ENDPOINT_REQUESTS, help='requests per endpoint')
+  parser.add_argument('--output', help='file to write the results to as JSON')
+  args = parser.parse_args()
+  for name in args.benchmarks:
+    if name not in BENCHMARKS:
+      parser.error('unknown benchmark {}'.format(name))
+
+  app = create_app({'SQLALCHEMY_DATABASE_URI': args.database})
+  results = {}
+  for name in args.benchmarks or sorted(BENCHMARKS):
+    with app.app_context():
+      db.create_all()
+      try:
+        db.session.add_all([Category(type='Category {}'.format(i)) for i in range(1, 7)])
+        db.session.commit()
+        results[name] = BENCHMARKS[name](app, args)
+      finally:
+        db.session.remove()
+        db.drop_all()
+        Question.clear_cache()
+        Category.clear_cache()
+
+  if args.output:
+    with app.app_context():
+      dialect = db.engine.dialect.name
+    with open(args.output, 'w') as f:
+      json.dump({
+        'commit': commit(),
+        'created': datetime.datetime.utcnow().isoformat() + 'Z',
+        'python': platform.python_version(),
+        'database': dialect,
+        'options': {'sizes': args.sizes, 'size': args.size, 'requests': args.requests},
+        'results': results
+      }, f, indent=2, sort_keys=True)
+      f.write('\n')
+
+
+if __name__ == '__main__':
+  main()
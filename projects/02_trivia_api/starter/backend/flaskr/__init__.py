@@ -1,15 +1,64 @@
-from flask import Flask, request, abort, jsonify
+from flask import Flask, Response, request, abort, jsonify, stream_with_context
 from flask_cors import CORS
 import random
 
+try:
+  # optional, several times faster than the json module on large pages
+  import orjson
+except ImportError:
+  orjson = None
+
 from models import setup_db, Question, Category
+from .quiz_sessions import MemoryStore, QuizSessions
+from . import bulk
 
 QUESTIONS_PER_PAGE = 10
+# random probes tried before listing the ids that are not excluded
+SAMPLE_PROBES = 16
+
+def random_question_id(ids, excluded, rng=random):
+  # picks an id uniformly at random among `ids` that are not in the set
+  # `excluded`, without copying `ids`. Probes are tried first; when they keep
+  # hitting excluded ids, most ids must be excluded, so the remaining ones are
+  # listed instead. Either way every remaining id is equally likely. Returns
+  # None when every id is excluded
+  if len(ids) == 0:
+    return None
+  for probe in range(SAMPLE_PROBES):
+    question_id = ids[rng.randrange(len(ids))]
+    if question_id not in excluded:
+      return question_id
+  candidates = [question_id for question_id in ids if question_id not in excluded]
+  if len(candidates) == 0:
+    return None
+  return rng.choice(candidates)
+
+def json_response(payload):
+  # like jsonify, through orjson when it is installed
+  if orjson is None:
+    return jsonify(payload)
+  return Response(orjson.dumps(payload), mimetype='application/json')
 
 def create_app(test_config=None):
   # create and configure the app
   app = Flask(__name__)
-  setup_db(app)
+  app.config.from_mapping(
+    # any object with get/set/delete, see flaskr/quiz_sessions.py
+    QUIZ_SESSION_STORE=None,
+    # bound of the default store: its entries, plus the ids they hold
+    QUIZ_SESSION_MAX_SIZE=100000,
+    QUIZ_SESSION_TTL=3600
+  )
+  if test_config is not None:
+    app.config.from_mapping(test_config)
+  if 'SQLALCHEMY_DATABASE_URI' in app.config:
+    setup_db(app, app.config['SQLALCHEMY_DATABASE_URI'])
+  else:
+    setup_db(app)
+
+  quiz_sessions = QuizSessions(
+    app.config['QUIZ_SESSION_STORE'] or MemoryStore(app.config['QUIZ_SESSION_MAX_SIZE'], QuizSessions.sizeof),
+    app.config['QUIZ_SESSION_TTL'])
   
   '''
   @TODO: Set up CORS. Allow '*' for origins. Delete the sample route after completing the TODOs
@@ -26,12 +75,15 @@ def create_app(test_config=None):
     return response
 
   def paginate_questions(request, selection):
+    # selection is an ordered query; only the columns of the requested page
+    # are fetched, without building Question objects
     page = request.args.get('page', 1, type=int)
+    if page < 1:
+      return []
     start = (page - 1) * QUESTIONS_PER_PAGE
-    end = start + QUESTIONS_PER_PAGE
 
-    questions = [question.format() for question in selection]
-    current_questions = questions[start:end]
+    rows = selection.with_entities(*Question.projection()).limit(QUESTIONS_PER_PAGE).offset(start).all()
+    current_questions = [Question.format_row(row) for row in rows]
 
     return current_questions
 
@@ -43,12 +95,14 @@ def create_app(test_config=None):
   @app.route('/categories', methods=['GET'])
   def get_categories():
     try:
-      categories = Category.query.all()
-      formatted_categories = [category.format() for category in categories]
-      formatted_categories = {str(category['id']) : category['type'] for category in formatted_categories}
-      return jsonify({
+      formatted_categories = {str(category_id) : category_type for category_id, category_type in Category.cached_types().items()}
+      response = jsonify({
         'categories': formatted_categories,
       })
+      # clients revalidating with If-None-Match get an empty 304 while the
+      # categories are unchanged
+      response.set_etag(Category.cached_etag())
+      return response.make_conditional(request)
     except:
       abort(500)
 
@@ -69,18 +123,18 @@ def create_app(test_config=None):
     # Implement pagination
     abort_422 = False
     try:
-      selection = Question.query.order_by(Question.id).all()
+      selection = Question.query.order_by(Question.id)
       current_questions = paginate_questions(request, selection)
 
       if len(current_questions) == 0:
         abort_422 = True
 
       if not abort_422:
-        return jsonify({
+        return json_response({
           'success': True,
           'questions': current_questions,
-          'total_questions': len(Question.query.all()),
-          'categories' : { str(category.id) : category.type for category in Category.query.all()}
+          'total_questions': Question.cached_count(),
+          'categories' : { str(category_id) : category_type for category_id, category_type in Category.cached_types().items()}
         })
 
     except:
@@ -107,15 +161,16 @@ def create_app(test_config=None):
 
       if not abort_422:
         question.delete()
-        selection = Question.query.order_by(Question.id).all()
-        current_questions = paginate_questions(request, selection)
-
-        return jsonify({
+        response = {
           'success': True,
           'deleted': question_id,
-          'questions': current_questions,
-          'total_questions': len(Question.query.all())
-        })
+          'total_questions': Question.cached_count()
+        }
+        # the page of questions is only sent to clients asking for one
+        if 'page' in request.args:
+          response['questions'] = paginate_questions(request, Question.query.order_by(Question.id))
+
+        return json_response(response)
 
     except:
       abort(500)
@@ -152,19 +207,20 @@ def create_app(test_config=None):
     new_category = body.get('category', None)
     new_difficulty = body.get('difficulty', None)
     search = body.get('searchTerm', None)
+    search_answers = body.get('searchAnswers', False)
 
     if not search and (not new_question or not new_answer):
       abort(500)
 
     try:
       if search:
-        selection = Question.query.order_by(Question.id).filter(Question.question.ilike('%{}%'.format(search)))
+        selection = Question.search(search, answers=search_answers)
         current_questions = paginate_questions(request, selection)
 
-        return jsonify({
+        return json_response({
           'success': True,
           'questions': current_questions,
-          'total_questions': len(selection.all())
+          'total_questions': selection.order_by(None).count()
         })
 
       elif search == '':
@@ -180,20 +236,58 @@ def create_app(test_config=None):
                             category=new_category,
                             difficulty=new_difficulty)
         question.insert()
-
-        selection = Question.query.order_by(Question.id).all()
-        current_questions = paginate_questions(request, selection)
-
-        return jsonify({
+        response = {
           'success': True,
           'created': question.id,
-          'questions': current_questions,
-          'total_questions': len(Question.query.all())
-        })
+          'total_questions': Question.cached_count()
+        }
+        if 'page' in request.args:
+          response['questions'] = paginate_questions(request, Question.query.order_by(Question.id))
 
+        return json_response(response)
+
+    except:
+      abort(500)
+
+  '''
+  Bulk import of a question pack, as NDJSON or, with Content-Type text/csv,
+  as CSV. Valid rows are inserted in batches; the response counts imported
+  and rejected rows and reports the throughput. When a batch fails, the
+  response is a 500 that still carries the summary of the batches imported
+  before it and the line the failed batch started at.
+  '''
+  @app.route('/questions/import', methods=['POST'])
+  def bulk_import():
+    format = 'csv' if request.mimetype == 'text/csv' else 'ndjson'
+    try:
+      summary = bulk.import_questions(request.stream, format, Category.cached_types())
     except:
       abort(500)
 
+    if summary['failed'] is not None:
+      return jsonify(dict(summary, success=False, error=500, message='internal server error')), 500
+    return jsonify(dict(summary, success=True))
+
+  '''
+  Streaming export of every question, as NDJSON or, with ?format=csv, as CSV.
+  '''
+  @app.route('/questions/export', methods=['GET'])
+  def bulk_export():
+    format = request.args.get('format', 'ndjson')
+    if format not in ('ndjson', 'csv'):
+      abort(422)
+
+    stats = {}
+
+    def generate():
+      for chunk in bulk.export_questions(format, stats):
+        yield chunk
+      app.logger.info('Exported %d questions in %.3fs (%.0f questions/s)', stats['exported'],
+                      stats['seconds'], stats['exported'] / stats['seconds'] if stats['seconds'] else 0)
+
+    mimetype = 'text/csv' if format == 'csv' else 'application/x-ndjson'
+    return Response(stream_with_context(generate()), mimetype=mimetype)
+
   '''
   @TODO: 
   Create a GET endpoint to get questions based on category. 
@@ -206,20 +300,20 @@ def create_app(test_config=None):
   def get_questions_by_categories(category_id):
     abort_422 = False
     try:
-      category = Category.query.filter(Category.id == category_id).one_or_none()
+      category_type = Category.cached_types().get(category_id)
 
-      if category is None:
+      if category_type is None:
         abort_422 = True
 
       if not abort_422:
-        questions = Question.query.filter(Question.category == category_id)
-        formatted_questions = [question.format() for question in questions]
+        selection = Question.query.filter(Question.category == category_id).order_by(Question.id)
+        current_questions = paginate_questions(request, selection)
 
-        return jsonify({
+        return json_response({
           'success': True,
-          'questions': formatted_questions,
-          'totalQuestions': len(formatted_questions),
-          'currentCategory': category.type
+          'questions': current_questions,
+          'totalQuestions': selection.order_by(None).count(),
+          'currentCategory': category_type
         })
     except:
       abort(500)
@@ -244,39 +338,81 @@ def create_app(test_config=None):
 
     previous_questions = body.get('previous_questions', [])
     quiz_category = body.get('quiz_category', 'click')
+    token = body.get('quiz_session', None)
 
+    abort_404 = False
     abort_422 = False
     try:
       if quiz_category == 'click':
-        questions = Question.query.filter(~Question.id.in_(previous_questions))
+        category_id = None
 
       else:
-        category = Category.query.filter(Category.type == quiz_category).one_or_none()
+        category_id = Category.cached_ids().get(quiz_category)
 
-        if category is None:
+        if category_id is None:
           abort_422 = True
 
-        else:
-          questions = Question.query.filter(Question.category == category.id, ~Question.id.in_(previous_questions))
+      if not abort_422 and token:
+        # a session goes on in its own category, over the ids it started
+        # with. When this worker does not know it, or no longer has its ids,
+        # the client starts over with its previous questions
+        session = quiz_sessions.get(token)
+        ids = Question.snapshot(session['snapshot']) if session is not None else None
 
-      if not abort_422:
-        questions = [question for question in questions]
+        if ids is None:
+          abort_404 = True
 
-        if len(questions) == 0:
-          return jsonify({
-            'question': None
-          })
+        elif 'quiz_category' in body and session['category'] != category_id:
+          abort_422 = True
 
         else:
-          question = random.choice(questions)
-
-          return jsonify({
-            'question': question.format()
-          })
+          try:
+            question = None
+            question_id = quiz_sessions.next(token, session, ids)
+            while question_id is not None:
+              # questions may have been deleted since the session started
+              question = Question.query.get(question_id)
+              if question is not None:
+                break
+              question_id = quiz_sessions.next(token, session, ids)
+
+            if question is None:
+              quiz_sessions.end(token)
+
+          except KeyError:
+            # the session expired in the meantime
+            abort_404 = True
+
+      elif not abort_422:
+        # the first question is sampled from the shared ids; the session then
+        # plays the others in the order of its permutation
+        snapshot, ids = Question.cached_snapshot(category_id)
+        excluded = set(previous_questions)
+        question = None
+        while question is None:
+          question_id = random_question_id(ids, excluded)
+          if question_id is None:
+            break
+          # cached ids may have been deleted by another process since
+          question = Question.query.get(question_id)
+          excluded.add(question_id)
+
+        token = None
+        if question is not None:
+          token = quiz_sessions.start(category_id, snapshot, excluded)
+
+      if not abort_404 and not abort_422:
+        return jsonify({
+          'question': question.format() if question is not None else None,
+          'quiz_session': token
+        })
 
     except:
       abort(500)
 
+    if abort_404:
+      abort(404)
+
     if abort_422:
       abort(422)
 
@@ -0,0 +1,161 @@
+'''
+Bulk question import and export.
+
+Imports read NDJSON (one JSON object per line) or CSV with a header row, with
+the columns question, answer, category and difficulty. Rows are validated and
+inserted in batches, each batch in its own transaction, so a question pack is
+never held in memory at once. A batch the database rejects ends the import;
+the batches before it stay imported, and the summary names the line it
+started at, to resume from. Exports write the same formats back, row by row.
+'''
+
+import csv
+import io
+import json
+import time
+
+from sqlalchemy.exc import SQLAlchemyError
+
+from models import db, Question
+
+BATCH_SIZE = 1000
+# invalid rows reported back in detail; the rest are only counted
+MAX_ERRORS = 100
+COLUMNS = ['id', 'question', 'answer', 'category', 'difficulty']
+
+def read_rows(stream, format):
+  # yields (line number, row dict or None, error or None) from a binary stream
+  text = io.TextIOWrapper(stream, encoding='utf-8', newline='')
+  if format == 'csv':
+    reader = csv.DictReader(text)
+    for row in reader:
+      yield reader.line_num, row, None
+  else:
+    for number, line in enumerate(text, 1):
+      if not line.strip():
+        continue
+      try:
+        row = json.loads(line)
+      except ValueError:
+        yield number, None, 'invalid JSON'
+        continue
+      if not isinstance(row, dict):
+        yield number, None, 'expected a JSON object'
+        continue
+      yield number, row, None
+
+def integer(value, text=False):
+  # value as an int, or None for bools, non-integral numbers and strings,
+  # unless text is set for CSV rows, whose cells are all strings
+  if isinstance(value, bool):
+    return None
+  if isinstance(value, int):
+    return value
+  if isinstance(value, float) and value.is_integer():
+    return int(value)
+  if text and isinstance(value, str):
+    try:
+      return int(value)
+    except ValueError:
+      return None
+  return None
+
+def validate(row, categories, text=False):
+  # (values to insert, None) or (None, error) for one input row
+  values = {}
+  for key in ['question', 'answer']:
+    value = row.get(key)
+    if not isinstance(value, str) or not value.strip():
+      return None, 'missing {}'.format(key)
+    values[key] = value.strip()
+  for key in ['category', 'difficulty']:
+    values[key] = integer(row.get(key), text)
+    if values[key] is None:
+      return None, 'invalid {}'.format(key)
+  if values['category'] not in categories:
+    return None, 'unknown category {}'.format(values['category'])
+  if not 1 <= values['difficulty'] <= 5:
+    return None, 'difficulty must be between 1 and 5'
+  return values, None
+
+def import_questions(stream, format, categories, batch_size=BATCH_SIZE):
+  # inserts the valid rows of stream and returns a summary of the import,
+  # with 'failed' set to the line and error of the batch that failed, if any
+  imported = rejected = 0
+  errors = []
+  batch = []
+  batch_line = None
+  failed = None
+  start = time.perf_counter()
+
+  def flush():
+    db.session.execute(Question.__table__.insert(), batch)
+    db.session.commit()
+
+  try:
+    for number, row, error in read_rows(stream, format):
+      values = None
+      if error is None:
+        values, error = validate(row, categories, format == 'csv')
+      if error is not None:
+        rejected += 1
+        if len(errors) < MAX_ERRORS:
+          errors.append({'line': number, 'error': error})
+        continue
+      if not batch:
+        batch_line = number
+      batch.append(values)
+      if len(batch) == batch_size:
+        flush()
+        imported += len(batch)
+        batch = []
+    if batch:
+      flush()
+      imported += len(batch)
+  except SQLAlchemyError as error:
+    db.session.rollback()
+    message = str(getattr(error, 'orig', None) or error).strip().splitlines()
+    failed = {'line': batch_line, 'error': message[0] if message else type(error).__name__}
+  except:
+    db.session.rollback()
+    raise
+  finally:
+    if imported:
+      Question.clear_cache()
+
+  seconds = time.perf_counter() - start
+  return {
+    'imported': imported,
+    'rejected': rejected,
+    'errors': errors,
+    'seconds': round(seconds, 3),
+    'questions_per_second': round(imported / seconds) if seconds else imported,
+    'failed': failed
+  }
+
+def export_questions(format, stats, batch_size=BATCH_SIZE):
+  # yields every question as NDJSON or CSV, fetched through a server-side
+  # cursor batch_size rows at a time; stats gets the row count and timing
+  # once the export is complete
+  start = time.perf_counter()
+  rows = db.session.query(*[getattr(Question, column) for column in COLUMNS]).order_by(
+    Question.id).execution_options(stream_results=True).yield_per(batch_size)
+  buffer = io.StringIO()
+  writer = csv.writer(buffer)
+  if format == 'csv':
+    writer.writerow(COLUMNS)
+  count = 0
+  for row in rows:
+    if format == 'csv':
+      writer.writerow(row)
+    else:
+      buffer.write(json.dumps(dict(zip(COLUMNS, row))))
+      buffer.write('\n')
+    count += 1
+    if count % batch_size == 0:
+      yield buffer.getvalue()
+      buffer.seek(0)
+      buffer.truncate()
+  yield buffer.getvalue()
+  stats['exported'] = count
+  stats['seconds'] = time.perf_counter() - start
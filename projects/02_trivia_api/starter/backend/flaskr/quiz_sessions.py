@@ -0,0 +1,148 @@
+'''
+Server-side quiz sessions.
+
+A quiz session plays the questions of a category in the order of a
+pseudo-random permutation of the category's ids, drawn from a seed, so a
+session holds a few numbers whatever the size of the question bank:
+
+- the category, and the key of the snapshot of its ids the quiz plays (see
+  Question.cached_snapshot()), so the permutation keeps indexing the same ids
+- the seed of the permutation
+- the ids to skip: the previous questions sent when the quiz started
+- a cursor into the permutation
+
+All but the cursor are written once when the session starts; the cursor is a
+plain int rewritten by every request. Any object with get(key),
+set(key, value, ttl) and delete(key) works as a store, e.g. a thin wrapper
+serializing values to JSON in redis, so that every worker sees every session.
+The default MemoryStore keeps them in the worker's memory.
+'''
+
+import bisect
+import collections
+import hashlib
+import random
+import secrets
+import threading
+import time
+
+# rounds of the Feistel network of permuted(); with 4, the first positions
+# of small categories are measurably biased
+FEISTEL_ROUNDS = 8
+
+def permuted(index, size, seed):
+  # the index-th position of a permutation of range(size) drawn from seed: a
+  # Feistel network over the smallest even number of bits holding size, run
+  # again on positions past size until one falls inside (cycle walking),
+  # less than four times on average
+  half = max(1, ((size - 1).bit_length() + 1) // 2)
+  mask = (1 << half) - 1
+  key = seed.to_bytes(8, 'big')
+  position = index
+  while True:
+    left, right = position >> half, position & mask
+    for step in range(FEISTEL_ROUNDS):
+      digest = hashlib.blake2b(bytes([step]) + right.to_bytes(8, 'big'), digest_size=8, key=key).digest()
+      left, right = right, left ^ (int.from_bytes(digest, 'big') & mask)
+    position = (left << half) | right
+    if position < size:
+      return position
+
+'''
+MemoryStore(max_size=100000, sizeof=None)
+    in-process store expiring entries after their ttl and evicting the least
+    recently used ones once their sizes add up to more than max_size. An
+    entry's size is sizeof(value), 1 by default
+'''
+class MemoryStore(object):
+  def __init__(self, max_size=100000, sizeof=None):
+    self.max_size = max_size
+    self.sizeof = sizeof if sizeof is not None else (lambda value: 1)
+    self.sessions = collections.OrderedDict()
+    self.size = 0
+    self.lock = threading.Lock()
+
+  def get(self, token):
+    with self.lock:
+      session, expires, size = self.sessions.get(token, (None, 0, 0))
+      if session is None:
+        return None
+      if expires <= time.monotonic():
+        self._pop(token)
+        return None
+      self.sessions.move_to_end(token)
+      return session
+
+  def set(self, token, session, ttl):
+    size = self.sizeof(session)
+    with self.lock:
+      self._pop(token)
+      self.sessions[token] = (session, time.monotonic() + ttl, size)
+      self.size += size
+      # the entry just set stays, whatever its size
+      while self.size > self.max_size and len(self.sessions) > 1:
+        self.size -= self.sessions.popitem(last=False)[1][2]
+
+  def delete(self, token):
+    with self.lock:
+      self._pop(token)
+
+  def _pop(self, token):
+    # with the lock held
+    entry = self.sessions.pop(token, None)
+    if entry is not None:
+      self.size -= entry[2]
+
+'''
+QuizSessions(store=None, ttl=3600)
+    creates, advances and ends quiz sessions; a session expires ttl seconds
+    after it started
+'''
+class QuizSessions(object):
+  def __init__(self, store=None, ttl=3600):
+    self.store = store if store is not None else MemoryStore(sizeof=QuizSessions.sizeof)
+    self.ttl = ttl
+
+  @staticmethod
+  def sizeof(value):
+    # size of a store entry for MemoryStore: 1, plus the ids a session skips
+    return 1 + len(value['excluded']) if isinstance(value, dict) else 1
+
+  def start(self, category, snapshot, excluded=(), rng=random):
+    # a new session for a category id (None for every category) playing the
+    # ids of a snapshot key, but the excluded ids. Returns its token
+    token = secrets.token_urlsafe(16)
+    self.store.set(token, {
+      'category': category,
+      'snapshot': snapshot,
+      'seed': rng.getrandbits(63),
+      'excluded': sorted(set(excluded))
+    }, self.ttl)
+    self.store.set(token + ':cursor', 0, self.ttl)
+    return token
+
+  def get(self, token):
+    # the session of a token, or None for an unknown or expired one
+    return self.store.get(token)
+
+  def next(self, token, session, ids):
+    # the next question id of a session, ids being the ids of its snapshot,
+    # and moves past it; None once every question was played. Raises
+    # KeyError for an unknown or expired token
+    cursor = self.store.get(token + ':cursor')
+    if cursor is None:
+      raise KeyError(token)
+    excluded = session['excluded']
+    question_id = None
+    while question_id is None and cursor < len(ids):
+      question_id = ids[permuted(cursor, len(ids), session['seed'])]
+      cursor += 1
+      index = bisect.bisect_left(excluded, question_id)
+      if index < len(excluded) and excluded[index] == question_id:
+        question_id = None
+    self.store.set(token + ':cursor', cursor, self.ttl)
+    return question_id
+
+  def end(self, token):
+    self.store.delete(token)
+    self.store.delete(token + ':cursor')
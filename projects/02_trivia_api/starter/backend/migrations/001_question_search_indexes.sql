@@ -0,0 +1,14 @@
+-- Trigram indexes serving question search (POST /questions with searchTerm).
+-- They let ILIKE '%term%' on questions and answers use an index instead of
+-- reading every row, and provide word_similarity() to rank the matches.
+--
+-- Apply to a database created from an earlier trivia.psql:
+--     psql trivia < migrations/001_question_search_indexes.sql
+-- Creating the extension needs a role allowed to do so (e.g. a superuser).
+-- The indexes are built without blocking writes, which cannot happen inside
+-- a transaction, so do not run this file with psql -1.
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_questions_question_trgm ON questions USING gin (question gin_trgm_ops);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_questions_answer_trgm ON questions USING gin (answer gin_trgm_ops);
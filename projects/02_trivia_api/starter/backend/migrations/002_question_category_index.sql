@@ -0,0 +1,24 @@
+-- Integer foreign key and index for questions.category, used by
+-- GET /categories/<id>/questions and the quiz.
+--
+-- Databases restored from trivia.psql already have an integer column with a
+-- foreign key; tables created from the models before this migration have a
+-- varchar column without one, which is converted here.
+--     psql trivia < migrations/002_question_category_index.sql
+-- The index is built without blocking writes, which cannot happen inside a
+-- transaction, so do not run this file with psql -1.
+
+DO $$
+BEGIN
+  IF (SELECT data_type FROM information_schema.columns
+      WHERE table_schema = current_schema() AND table_name = 'questions' AND column_name = 'category') <> 'integer' THEN
+    ALTER TABLE questions ALTER COLUMN category TYPE integer USING category::integer;
+  END IF;
+  IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conrelid = 'questions'::regclass AND contype = 'f') THEN
+    ALTER TABLE questions ADD CONSTRAINT category FOREIGN KEY (category)
+      REFERENCES categories (id) ON UPDATE CASCADE ON DELETE SET NULL;
+  END IF;
+END
+$$;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_questions_category ON questions (category, id);
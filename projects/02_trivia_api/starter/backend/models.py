@@ -1,11 +1,24 @@
 import os
-from sqlalchemy import Column, String, Integer, create_engine
+from sqlalchemy import Column, String, Integer, ForeignKey, Index, create_engine, func, or_
 from flask_sqlalchemy import SQLAlchemy
+import array
+import collections
+import hashlib
 import json
+import time
 
 database_name = "trivia"
 database_path = "postgres://{}/{}".format('localhost:5432', database_name)
 
+# seconds a question count or id list is reused before querying again
+COUNT_TTL = 60
+# ids kept in the id arrays quiz sessions may still be playing, see
+# Question.cached_snapshot()
+SNAPSHOT_IDS = 4000000
+# seconds the categories are reused before reading them again, so that
+# changes made by other processes show up
+CATEGORY_TTL = 300
+
 db = SQLAlchemy()
 
 '''
@@ -25,11 +38,21 @@ Question
 '''
 class Question(db.Model):  
   __tablename__ = 'questions'
+  # serves category pages and quiz id lists, both ordered by id
+  __table_args__ = (
+    Index('ix_questions_category', 'category', 'id'),
+  )
+
+  _count = None
+  _count_expires = 0
+  _ids = {}
+  _snapshots = collections.OrderedDict()
+  _snapshot_ids = 0
 
   id = Column(Integer, primary_key=True)
   question = Column(String)
   answer = Column(String)
-  category = Column(String)
+  category = Column(Integer, ForeignKey('categories.id', onupdate='CASCADE', ondelete='SET NULL'))
   difficulty = Column(Integer)
 
   def __init__(self, question, answer, category, difficulty):
@@ -41,6 +64,7 @@ class Question(db.Model):
   def insert(self):
     db.session.add(self)
     db.session.commit()
+    Question.changed(1)
   
   def update(self):
     db.session.commit()
@@ -48,6 +72,110 @@ class Question(db.Model):
   def delete(self):
     db.session.delete(self)
     db.session.commit()
+    Question.changed(-1)
+
+  '''
+  projection(), format_row(row)
+      the columns of format(), and a row of them as format() would return it,
+      to query many questions without building Question objects
+  '''
+  @classmethod
+  def projection(cls):
+    return [cls.id, cls.question, cls.answer, cls.category, cls.difficulty]
+
+  @staticmethod
+  def format_row(row):
+    return row._asdict()
+
+  '''
+  cached_count()
+      total number of questions, counted at most every COUNT_TTL seconds and
+      kept in step with the inserts and deletes made through this process
+  '''
+  @classmethod
+  def cached_count(cls):
+    now = time.monotonic()
+    if cls._count is None or now >= cls._count_expires:
+      cls._count = db.session.query(func.count(cls.id)).scalar()
+      cls._count_expires = now + COUNT_TTL
+    return cls._count
+
+  '''
+  cached_ids(category=None)
+      ids of the questions in a category, or of all questions, as a compact
+      array, cached like cached_count()
+  cached_snapshot(category=None), snapshot(key)
+      the key and the ids of cached_ids(), and the ids of a key. Keys are
+      digests of the ids, so every process reading the same ids derives the
+      same key. Arrays no longer cached stay available by key, least recently
+      used first out, while they hold no more than SNAPSHOT_IDS ids; snapshot()
+      returns None for a key no longer kept
+  '''
+  @classmethod
+  def cached_ids(cls, category=None):
+    return cls.cached_snapshot(category)[1]
+
+  @classmethod
+  def cached_snapshot(cls, category=None):
+    now = time.monotonic()
+    key, ids, expires = cls._ids.get(category, (None, None, 0))
+    if ids is None or now >= expires:
+      query = db.session.query(cls.id).order_by(cls.id)
+      if category is not None:
+        query = query.filter(cls.category == category)
+      ids = array.array('q', (row[0] for row in query))
+      key = '{}:{}'.format(category, hashlib.blake2b(ids.tobytes(), digest_size=12).hexdigest())
+      previous = cls._snapshots.pop(key, None)
+      if previous is not None:
+        # unchanged since an earlier read: the kept array is shared
+        ids = previous
+        cls._snapshot_ids -= len(ids)
+      cls._snapshots[key] = ids
+      cls._snapshot_ids += len(ids)
+      while cls._snapshot_ids > SNAPSHOT_IDS and len(cls._snapshots) > 1:
+        cls._snapshot_ids -= len(cls._snapshots.popitem(last=False)[1])
+      cls._ids[category] = (key, ids, now + COUNT_TTL)
+    return key, ids
+
+  @classmethod
+  def snapshot(cls, key):
+    for cached_key, ids, expires in cls._ids.values():
+      if cached_key == key:
+        return ids
+    ids = cls._snapshots.get(key)
+    if ids is not None:
+      cls._snapshots.move_to_end(key)
+    return ids
+
+  @classmethod
+  def changed(cls, delta):
+    # delta questions were added (or removed, if negative)
+    if cls._count is not None:
+      cls._count += delta
+    cls._ids = {}
+
+  @classmethod
+  def clear_cache(cls):
+    cls._count = None
+    cls._ids = {}
+
+  '''
+  search(term, answers=False)
+      query of the questions containing term, case insensitive, and of those
+      whose answer contains it if answers is True. On PostgreSQL the matches
+      are found through the trigram indexes of trivia.psql and ranked by
+      word similarity, best first; elsewhere they are ordered by id
+  '''
+  @classmethod
+  def search(cls, term, answers=False):
+    pattern = '%{}%'.format(term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_'))
+    columns = [cls.question, cls.answer] if answers else [cls.question]
+    query = cls.query.filter(or_(*[column.ilike(pattern, escape='\\') for column in columns]))
+    if db.engine.dialect.name != 'postgresql':
+      return query.order_by(cls.id)
+    ranks = [func.word_similarity(term, column) for column in columns]
+    rank = func.greatest(*ranks) if answers else ranks[0]
+    return query.order_by(rank.desc(), cls.id)
 
   def format(self):
     return {
@@ -65,14 +193,63 @@ Category
 class Category(db.Model):  
   __tablename__ = 'categories'
 
+  # (id -> type, type -> id, etag, expires)
+  _cache = None
+
   id = Column(Integer, primary_key=True)
   type = Column(String)
 
   def __init__(self, type):
     self.type = type
 
+  def insert(self):
+    db.session.add(self)
+    db.session.commit()
+    Category.clear_cache()
+
+  def update(self):
+    db.session.commit()
+    Category.clear_cache()
+
+  def delete(self):
+    db.session.delete(self)
+    db.session.commit()
+    Category.clear_cache()
+
   def format(self):
     return {
       'id': self.id,
       'type': self.type
-    }
\ No newline at end of file
+    }
+
+  '''
+  cached_types(), cached_ids(), cached_etag()
+      the id -> type and type -> id maps of every category, and an ETag
+      of their content, read in one query at most every CATEGORY_TTL seconds
+      and after every change made through this process
+  '''
+  @classmethod
+  def _cached(cls):
+    now = time.monotonic()
+    if cls._cache is None or now >= cls._cache[3]:
+      types = {category.id: category.type for category in cls.query.order_by(cls.id)}
+      ids = {category_type: category_id for category_id, category_type in types.items()}
+      etag = hashlib.md5(json.dumps(sorted(types.items())).encode()).hexdigest()
+      cls._cache = (types, ids, etag, now + CATEGORY_TTL)
+    return cls._cache
+
+  @classmethod
+  def cached_types(cls):
+    return cls._cached()[0]
+
+  @classmethod
+  def cached_ids(cls):
+    return cls._cached()[1]
+
+  @classmethod
+  def cached_etag(cls):
+    return cls._cached()[2]
+
+  @classmethod
+  def clear_cache(cls):
+    cls._cache = None
\ No newline at end of file
@@ -1,8 +1,13 @@
 import unittest
+import array
+import io
 import json
+import random
+from collections import Counter
 from flask_sqlalchemy import SQLAlchemy
 
-from flaskr import create_app
+from flaskr import bulk, create_app, random_question_id
+from flaskr.quiz_sessions import MemoryStore, QuizSessions, permuted
 from models import setup_db, Question, Category
 
 
@@ -46,6 +51,119 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 200)
         self.assertTrue(data['categories'])
 
+    def test_get_categories_not_modified(self):
+        res = self.client().get('/categories')
+        etag = res.headers['ETag']
+
+        res = self.client().get('/categories', headers={'If-None-Match': etag})
+
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res.data, b'')
+
+    def test_get_categories_after_change(self):
+        etag = self.client().get('/categories').headers['ETag']
+        with self.app.app_context():
+            category = Category(type='Music')
+            category.insert()
+            category_id = category.id
+
+        res = self.client().get('/categories', headers={'If-None-Match': etag})
+        data = json.loads(res.data)
+        with self.app.app_context():
+            Category.query.get(category_id).delete()
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['categories'][str(category_id)], 'Music')
+        self.assertNotEqual(res.headers['ETag'], etag)
+
+    def test_bulk_import_and_export(self):
+        pack = '\n'.join([
+            json.dumps({'question': 'Bulk question 1', 'answer': 'One', 'category': 1, 'difficulty': 1}),
+            json.dumps({'question': 'Bulk question 2', 'answer': 'Two', 'category': 1, 'difficulty': 6}),
+            'not json',
+            json.dumps({'question': 'Bulk question 3', 'answer': 'Three', 'category': 1000, 'difficulty': 1}),
+        ])
+        res = self.client().post('/questions/import', data=pack, content_type='application/x-ndjson')
+        data = json.loads(res.data)
+
+        res = self.client().get('/questions/export')
+        exported = [json.loads(line) for line in res.data.decode().splitlines()]
+        with self.app.app_context():
+            for question in Question.query.filter(Question.question.like('Bulk question%')):
+                question.delete()
+
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['imported'], 1)
+        self.assertEqual(data['rejected'], 3)
+        self.assertEqual([error['line'] for error in data['errors']], [2, 3, 4])
+        self.assertEqual(res.status_code, 200)
+        self.assertIn(('Bulk question 1', 'One', 1, 1),
+                      [(question['question'], question['answer'], int(question['category']), question['difficulty'])
+                       for question in exported])
+
+    def test_bulk_import_rejects_non_integers(self):
+        pack = '\n'.join([
+            json.dumps({'question': 'Bulk question 5', 'answer': 'Five', 'category': 1, 'difficulty': 3.0}),
+            json.dumps({'question': 'Bulk question 6', 'answer': 'Six', 'category': 1, 'difficulty': 2.7}),
+            json.dumps({'question': 'Bulk question 7', 'answer': 'Seven', 'category': 1, 'difficulty': True}),
+            json.dumps({'question': 'Bulk question 8', 'answer': 'Eight', 'category': '1', 'difficulty': 1}),
+        ])
+        res = self.client().post('/questions/import', data=pack, content_type='application/x-ndjson')
+        data = json.loads(res.data)
+        with self.app.app_context():
+            for question in Question.query.filter(Question.question.like('Bulk question%')):
+                question.delete()
+
+        self.assertEqual(data['imported'], 1)
+        self.assertEqual(data['errors'], [
+            {'line': 2, 'error': 'invalid difficulty'},
+            {'line': 3, 'error': 'invalid difficulty'},
+            {'line': 4, 'error': 'invalid category'}
+        ])
+
+    def test_bulk_import_csv(self):
+        pack = 'question,answer,category,difficulty\nBulk question 4,Four,2,3\nBulk question 5,Five,2,2.7\n'
+        res = self.client().post('/questions/import', data=pack, content_type='text/csv')
+        data = json.loads(res.data)
+        with self.app.app_context():
+            for question in Question.query.filter(Question.question.like('Bulk question%')):
+                question.delete()
+
+        self.assertEqual(data['imported'], 1)
+        self.assertEqual(data['errors'], [{'line': 3, 'error': 'invalid difficulty'}])
+
+    def test_bulk_import_failed_batch(self):
+        # category 99999 passes validation but not the foreign key, so the
+        # second batch fails and the rows after it are never read
+        pack = '\n'.join([
+            json.dumps({'question': 'Bulk question {}'.format(number), 'answer': 'Answer',
+                        'category': 99999 if number == 4 else 1, 'difficulty': 1})
+            for number in range(1, 6)
+        ])
+        with self.app.app_context():
+            summary = bulk.import_questions(io.BytesIO(pack.encode()), 'ndjson', {1, 99999}, batch_size=2)
+            questions = [question.question for question in
+                         Question.query.filter(Question.question.like('Bulk question%')).order_by(Question.id)]
+            for question in Question.query.filter(Question.question.like('Bulk question%')):
+                question.delete()
+
+        self.assertEqual(summary['imported'], 2)
+        self.assertEqual(summary['failed']['line'], 3)
+        self.assertIn('foreign key', summary['failed']['error'])
+        self.assertEqual(questions, ['Bulk question 1', 'Bulk question 2'])
+
+    def test_422_bulk_export_unknown_format(self):
+        res = self.client().get('/questions/export?format=xml')
+
+        self.assertEqual(res.status_code, 422)
+
+    def test_format_row_matches_format(self):
+        with self.app.app_context():
+            question = Question.query.order_by(Question.id).first()
+            row = Question.query.filter(Question.id == question.id).with_entities(*Question.projection()).one()
+
+            self.assertEqual(Question.format_row(row), question.format())
+
     def test_get_paginated_questions(self):
         res = self.client().get('/questions')
         data = json.loads(res.data)
@@ -80,6 +198,17 @@ class TriviaTestCase(unittest.TestCase):
         # self.assertTrue(data['total_questions'] == 20)
         # self.assertTrue(len(data['questions']) == 10)
 
+    def test_create_new_question_without_page(self):
+        res = self.client().post('/questions', json=self.new_question)
+        data = json.loads(res.data)
+        with self.app.app_context():
+            Question.query.get(data['created']).delete()
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertTrue(data['total_questions'])
+        self.assertNotIn('questions', data)
+
     def test_get_question_search_with_results(self):
         res = self.client().post('/questions', json={'searchTerm': 'expressionism'})
         data = json.loads(res.data)
@@ -98,6 +227,28 @@ class TriviaTestCase(unittest.TestCase):
         self.assertTrue(data['total_questions'])
         self.assertEqual(len(data['questions']), 2)
 
+    def test_get_question_search_in_answers(self):
+        res = self.client().post('/questions', json={'searchTerm': 'apollo 13', 'searchAnswers': True})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['total_questions'], 1)
+        self.assertEqual(data['questions'][0]['answer'], 'Apollo 13')
+
+    def test_get_question_search_not_in_answers(self):
+        res = self.client().post('/questions', json={'searchTerm': 'apollo 13'})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['total_questions'], 0)
+
+    def test_get_question_search_wildcards_are_literal(self):
+        res = self.client().post('/questions', json={'searchTerm': '%'})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['total_questions'], 0)
+
     def test_get_question_search_without_results(self):
         res = self.client().post('/questions', json={'searchTerm': 'avengers'})
         data = json.loads(res.data)
@@ -117,8 +268,16 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['totalQuestions'], 4)
         self.assertEqual(data['currentCategory'], 'History')
 
+    def test_get_questions_by_category_beyond_last_page(self):
+        res = self.client().get('categories/4/questions?page=2')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['questions'], [])
+        self.assertEqual(data['totalQuestions'], 4)
+
     def test_delete_question(self):
-        res = self.client().delete('/questions/34')
+        res = self.client().delete('/questions/34?page=1')
         data = json.loads(res.data)
 
         self.assertEqual(res.status_code, 200)
@@ -135,6 +294,82 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 200)
         self.assertTrue(data['question'])
 
+    def play(self, client, data, quiz_category='Entertainment'):
+        # plays the quiz a response started to the end; (question ids, last response)
+        asked = []
+        res = None
+        while data['question']:
+            asked.append(data['question']['id'])
+            res = client.post('/quizzes', json={'quiz_session': data['quiz_session'],
+                                                'quiz_category': quiz_category})
+            data = json.loads(res.data)
+        return asked, res
+
+    def test_next_question_with_quiz_session(self):
+        res = self.client().post('/quizzes', json={'previous_questions': [],
+                                                   'quiz_category': 'Entertainment'})
+        data = json.loads(res.data)
+        token = data['quiz_session']
+        asked, res = self.play(self.client(), data)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['quiz_session'], token)
+        self.assertEqual(len(asked), len(set(asked)))
+        self.assertEqual(len(asked), 3)
+
+    def test_quiz_session_on_another_app_instance(self):
+        res = self.client().post('/quizzes', json={'previous_questions': [],
+                                                   'quiz_category': 'Entertainment'})
+        data = json.loads(res.data)
+        first = data['question']['id']
+        other = create_app()
+        setup_db(other, self.database_path)
+        client = other.test_client()
+
+        # the other instance has its own store: the client starts over
+        res = client.post('/quizzes', json={'quiz_session': data['quiz_session'],
+                                            'quiz_category': 'Entertainment'})
+        self.assertEqual(res.status_code, 404)
+        res = client.post('/quizzes', json={'previous_questions': [first],
+                                            'quiz_category': 'Entertainment'})
+        data = json.loads(res.data)
+        asked, res = self.play(client, data)
+        with self.app.app_context():
+            category_id = Category.cached_ids()['Entertainment']
+            categories = [Question.query.get(question_id).category for question_id in asked]
+
+        self.assertEqual(categories, [category_id] * 2)
+        self.assertNotIn(first, asked)
+
+    def test_quiz_session_in_a_shared_store(self):
+        store = MemoryStore()
+        apps = [create_app({'QUIZ_SESSION_STORE': store}) for i in range(2)]
+        for app in apps:
+            setup_db(app, self.database_path)
+        res = apps[0].test_client().post('/quizzes', json={'previous_questions': [],
+                                                           'quiz_category': 'Entertainment'})
+        data = json.loads(res.data)
+        first = data['question']['id']
+        asked, res = self.play(apps[1].test_client(), data)
+        with self.app.app_context():
+            category_id = Category.cached_ids()['Entertainment']
+            categories = [Question.query.get(question_id).category for question_id in asked]
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(categories, [category_id] * 3)
+        self.assertEqual(asked[0], first)
+        self.assertEqual(len(set(asked)), 3)
+
+    def test_422_quiz_session_in_another_category(self):
+        res = self.client().post('/quizzes', json={'previous_questions': [],
+                                                   'quiz_category': 'Entertainment'})
+        data = json.loads(res.data)
+        res = self.client().post('/quizzes', json={'quiz_session': data['quiz_session'],
+                                                   'quiz_category': 'Science'})
+
+        self.assertEqual(res.status_code, 422)
+
     def test_422_sent_requesting_beyond_valid_page(self):
         res = self.client().get('/questions?page=1000')
         data = json.loads(res.data)
@@ -208,6 +443,152 @@ class TriviaTestCase(unittest.TestCase):
     #     self.assertEqual(data['success'], False)
     #     self.assertEqual(data['message'], 'unprocessable')
 
+class RandomQuestionIdTestCase(unittest.TestCase):
+    """Checks that quiz questions are drawn uniformly from the questions that
+    were not asked yet, with a chi-square goodness of fit test"""
+
+    # chi-square critical values at p = 0.001 by degrees of freedom, so that a
+    # uniform sampler fails one run in a thousand, were the seed not fixed
+    CRITICAL_VALUES = {9: 27.877, 19: 43.820, 49: 85.351}
+
+    def setUp(self):
+        self.rng = random.Random(1234)
+
+    def assertUniform(self, ids, excluded, draws=20000):
+        remaining = [i for i in ids if i not in excluded]
+        counts = Counter(random_question_id(ids, excluded, self.rng) for i in range(draws))
+        self.assertEqual(set(counts), set(remaining))
+        expected = draws / len(remaining)
+        chi_square = sum((counts[i] - expected) ** 2 / expected for i in remaining)
+        self.assertLess(chi_square, self.CRITICAL_VALUES[len(remaining) - 1])
+
+    def test_uniform_without_previous_questions(self):
+        self.assertUniform(list(range(1, 21)), set())
+
+    def test_uniform_with_some_previous_questions(self):
+        # probes alone find a question
+        self.assertUniform(list(range(1, 101)), set(range(1, 101, 2)))
+
+    def test_uniform_with_most_previous_questions(self):
+        # probes keep hitting previous questions, so the rest are listed
+        ids = list(range(1, 1001))
+        self.assertUniform(ids, set(ids[10:]))
+
+    def test_previous_questions_outside_category(self):
+        self.assertUniform(list(range(1, 21)), set(range(100, 10000)))
+
+    def test_no_question_left(self):
+        ids = list(range(1, 21))
+        self.assertIsNone(random_question_id(ids, set(ids), self.rng))
+        self.assertIsNone(random_question_id([], set(), self.rng))
+
+class QuizSessionsTestCase(unittest.TestCase):
+    """Checks that quiz sessions play every question not excluded once, in
+    the order of a permutation whose positions are uniformly distributed,
+    which a chi-square goodness of fit test checks"""
+
+    CRITICAL_VALUES = RandomQuestionIdTestCase.CRITICAL_VALUES
+
+    def setUp(self):
+        self.rng = random.Random(1234)
+        self.sessions = QuizSessions(MemoryStore(), 60)
+
+    def play(self, token, ids):
+        session = self.sessions.get(token)
+        played = []
+        question_id = self.sessions.next(token, session, ids)
+        while question_id is not None:
+            played.append(question_id)
+            question_id = self.sessions.next(token, session, ids)
+        return played
+
+    def test_permutations(self):
+        for size in list(range(1, 70)) + [1000, 4097]:
+            seed = self.rng.getrandbits(63)
+            self.assertEqual(sorted(permuted(i, size, seed) for i in range(size)), list(range(size)))
+
+    def test_uniform_positions(self):
+        # the second question played, the first being sampled apart
+        for size in [10, 50]:
+            counts = Counter(permuted(1, size, self.rng.getrandbits(63)) for i in range(20000))
+            expected = 20000 / size
+            chi_square = sum((counts[i] - expected) ** 2 / expected for i in range(size))
+            self.assertLess(chi_square, self.CRITICAL_VALUES[size - 1])
+
+    def test_every_question_played_once(self):
+        ids = array.array('q', range(1, 51))
+        token = self.sessions.start(1, 'snapshot', [3, 4, 1000], self.rng)
+        played = self.play(token, ids)
+        self.assertEqual(sorted(played), [i for i in range(1, 51) if i not in (3, 4)])
+        self.assertIsNone(self.sessions.next(token, self.sessions.get(token), ids))
+
+    def test_session_size_independent_of_ids(self):
+        token = self.sessions.start(None, 'snapshot', [3, 4], self.rng)
+        session = self.sessions.get(token)
+        self.sessions.next(token, session, array.array('q', range(1000000)))
+        self.assertEqual(session['excluded'], [3, 4])
+        self.assertLess(len(json.dumps(session)), 200)
+        self.assertEqual(QuizSessions.sizeof(session), 3)
+
+    def test_next_writes_only_the_cursor(self):
+        token = self.sessions.start(1, 'snapshot', [], self.rng)
+        session = self.sessions.get(token)
+        self.sessions.next(token, session, array.array('q', range(1, 11)))
+        self.assertIs(self.sessions.get(token), session)
+        self.assertEqual(self.sessions.store.get(token + ':cursor'), 1)
+
+    def test_unknown_or_ended_session(self):
+        token = self.sessions.start(1, 'snapshot', [], self.rng)
+        session = self.sessions.get(token)
+        self.sessions.end(token)
+        self.assertIsNone(self.sessions.get(token))
+        self.assertIsNone(self.sessions.get('unknown'))
+        with self.assertRaises(KeyError):
+            self.sessions.next(token, session, array.array('q', [1, 2]))
+
+class MemoryStoreTestCase(unittest.TestCase):
+    """Checks expiry and eviction of in-memory quiz sessions"""
+
+    def test_get_saved_session(self):
+        store = MemoryStore()
+        store.set('a', {'category': 1, 'asked': [2]}, 60)
+        self.assertEqual(store.get('a'), {'category': 1, 'asked': [2]})
+        self.assertIsNone(store.get('b'))
+
+    def test_session_expires(self):
+        store = MemoryStore()
+        store.set('a', {'category': 1, 'asked': []}, 0)
+        self.assertIsNone(store.get('a'))
+        self.assertEqual(len(store.sessions), 0)
+
+    def test_least_recently_used_session_evicted(self):
+        store = MemoryStore(max_size=2)
+        store.set('a', {'category': 1, 'asked': []}, 60)
+        store.set('b', {'category': 2, 'asked': []}, 60)
+        store.get('a')
+        store.set('c', {'category': 3, 'asked': []}, 60)
+        self.assertIsNotNone(store.get('a'))
+        self.assertIsNone(store.get('b'))
+        self.assertIsNotNone(store.get('c'))
+
+    def test_evicted_by_size(self):
+        store = MemoryStore(max_size=5, sizeof=QuizSessions.sizeof)
+        store.set('a', {'category': 1, 'excluded': [1, 2]}, 60)
+        store.set('b', {'category': 1, 'excluded': []}, 60)
+        store.set('c', {'category': 1, 'excluded': [3]}, 60)
+        self.assertIsNone(store.get('a'))
+        self.assertEqual(store.size, 3)
+        # an entry larger than the store stays until the next one
+        store.set('d', {'category': 1, 'excluded': list(range(10))}, 60)
+        self.assertEqual(list(store.sessions), ['d'])
+
+    def test_delete_session(self):
+        store = MemoryStore()
+        store.set('a', {'category': 1, 'asked': []}, 60)
+        store.delete('a')
+        store.delete('a')
+        self.assertIsNone(store.get('a'))
+
 # Make the tests conveniently executable
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
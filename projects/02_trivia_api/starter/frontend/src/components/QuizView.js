@@ -10,6 +10,7 @@ class QuizView extends Component {
     super();
     this.state = {
         quizCategory: null,
+        quizSession: null,
         previousQuestions: [], 
         showAnswer: false,
         categories: {},
@@ -47,12 +48,18 @@ class QuizView extends Component {
     const previousQuestions = [...this.state.previousQuestions]
     if(this.state.currentQuestion.id) { previousQuestions.push(this.state.currentQuestion.id) }
 
+    const quizSession = this.state.quizSession
     $.ajax({
       url: '/quizzes', //TODO: update request URL
       type: "POST",
       dataType: 'json',
       contentType: 'application/json',
-      data: JSON.stringify({
+      // once the server has started a quiz session, it remembers the
+      // previous questions: the session token is sent back with the category
+      data: JSON.stringify(quizSession ? {
+        quiz_session: quizSession,
+        quiz_category: this.state.quizCategory.type
+      } : {
         previous_questions: previousQuestions,
         quiz_category: this.state.quizCategory.type
       }),
@@ -63,6 +70,7 @@ class QuizView extends Component {
       success: (result) => {
         this.setState({
           showAnswer: false,
+          quizSession: result.quiz_session,
           previousQuestions: previousQuestions,
           currentQuestion: result.question,
           guess: '',
@@ -71,6 +79,11 @@ class QuizView extends Component {
         return;
       },
       error: (error) => {
+        if (quizSession && error.status === 404) {
+          // the server lost the session: start over from the previous questions
+          this.setState({quizSession: null}, this.getNextQuestion)
+          return;
+        }
         alert(error.responseJSON.error + " " + error.responseJSON.message + ". Please try again.")
         return;
       }
@@ -90,6 +103,7 @@ class QuizView extends Component {
   restartGame = () => {
     this.setState({
       quizCategory: null,
+      quizSession: null,
       previousQuestions: [], 
       showAnswer: false,
       numCorrect: 0,
@@ -1,6 +1,8 @@
 import os
-from flask import Flask, request, jsonify, abort
+import click
+from flask import Flask, Response, request, jsonify, abort
 from sqlalchemy import exc
+from flask_migrate import Migrate
 import json
 from flask_cors import CORS
 from functools import wraps
@@ -8,11 +10,14 @@ from jose import jwt
 from urllib.request import urlopen
 import sys
 
-from database.models import db_drop_and_create_all, setup_db, Drink
+from database.models import db_drop_and_create_all, seed_db, setup_db, db, Drink, menu
 from auth.auth import AuthError, requires_auth
 
 app = Flask(__name__)
 setup_db(app)
+# batch mode lets migrations alter columns on sqlite, which has no ALTER COLUMN
+migrate = Migrate(app, db, render_as_batch=True,
+                  directory=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations'))
 CORS(app)
 
 AUTH0_DOMAIN = 'dev-pkce2vgx.us.auth0.com'
@@ -20,12 +25,42 @@ ALGORITHMS = ['RS256']
 API_AUDIENCE = 'fsnd'
 
 '''
-@TODO uncomment the following line to initialize the datbase
-!! NOTE THIS WILL DROP ALL RECORDS AND START YOUR DB FROM SCRATCH
-!! NOTE THIS MUST BE UNCOMMENTED ON FIRST RUN
-!! Running this funciton will add one
+The app starts against an existing database and never changes its schema.
+Initialize or upgrade the database, and add the demo drink, with
+    flask init-db
+or start it from scratch with
+    flask reset-db
+!! NOTE reset-db DROPS ALL RECORDS
 '''
-db_drop_and_create_all()
+@app.cli.command('init-db')
+def init_db():
+    '''Apply the migrations and add the demo drink to an empty database.'''
+    from flask_migrate import upgrade
+    upgrade()
+    seed_db()
+
+
+@app.cli.command('reset-db')
+@click.confirmation_option(prompt='This drops all records. Continue?')
+def reset_db():
+    '''Drop and recreate every table, and add the demo drink.'''
+    from flask_migrate import stamp
+    db_drop_and_create_all()
+    stamp()
+
+'''
+menu_response(form)
+    the 'short' or 'long' menu from the snapshot kept by database.models,
+    or an empty 304 when the client's If-None-Match has its ETag, without
+    querying the database either way while the snapshot is fresh
+'''
+def menu_response(form):
+    snapshot = menu.get()
+    response = Response(snapshot[form], mimetype='application/json')
+    response.set_etag(snapshot[form + '_etag'])
+    # clients may keep the menu, but must revalidate it on every poll
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
 
 # ROUTES
 '''
@@ -40,11 +75,7 @@ db_drop_and_create_all()
 @requires_auth('get:drinks')
 def drinks():
     try:
-        drinks = Drink.query.all()
-        return jsonify({
-            'success': True,
-            'drinks': [drink.short() for drink in drinks]
-        })
+        return menu_response('short')
     except:
         abort(422)
 
@@ -60,11 +91,7 @@ def drinks():
 @requires_auth('get:drinks-detail')
 def drinks_detail():
     try:
-        drinks = Drink.query.all()
-        return jsonify({
-            'success': True,
-            'drinks': [drink.long() for drink in drinks]
-        })
+        return menu_response('long')
     except:
         abort(422)
 
@@ -86,7 +113,7 @@ def create_drink():
         drink_recipe = body.get('recipe', None)
         drink = Drink(
             title=drink_title,
-            recipe=json.dumps(drink_recipe)
+            recipe=drink_recipe
         )
         drink.insert()
         return jsonify({
@@ -124,7 +151,7 @@ def update_drink(drink_id):
             abort_404 = True
         else:
             drink.title = drink_title
-            drink.recipe = json.dumps(drink_recipe)
+            drink.recipe = drink_recipe
 
             drink.update()
 
@@ -242,5 +269,14 @@ def forbidden(error):
         "description": error.description['description']
     }), 403
 
+@app.errorhandler(503)
+def service_unavailable(error):
+    return jsonify({
+        "success": False,
+        "error": 503,
+        "code": error.description['code'],
+        "description": error.description['description']
+    }), 503
+
 if __name__ == '__main__':
     app.run(debug=True)
\ No newline at end of file
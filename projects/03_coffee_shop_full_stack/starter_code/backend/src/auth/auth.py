@@ -1,14 +1,24 @@
-import json
-from flask import request, _request_ctx_stack, abort
+import os
+from flask import request, abort
 from functools import wraps
 from jose import jwt
 from jose.jwt import JWTError
-from urllib.request import urlopen
+
+from .jwks import KeyStore, JWKSError
+from .tokens import TokenCache
 
 
 AUTH0_DOMAIN = 'dev-pkce2vgx.us.auth0.com'
 ALGORITHMS = ['RS256']
 API_AUDIENCE = 'fsnd'
+JWKS_URL = os.environ.get('JWKS_URL', f'https://{AUTH0_DOMAIN}/.well-known/jwks.json')
+
+# signing keys of the identity provider, fetched once and refreshed in the
+# background, see auth/jwks.py
+jwks = KeyStore(JWKS_URL)
+# payloads of tokens that passed verify_decode_jwt, until they expire, see
+# auth/tokens.py
+verified_tokens = TokenCache()
 
 ## AuthError Exception
 '''
@@ -75,14 +85,17 @@ def get_token_auth_header():
     it should raise an AuthError if the requested permission string is not in the payload permissions array
     return true otherwise
 '''
-def check_permissions(permission, payload):
-    if 'permissions' not in payload:
-                        raise AuthError({
-                            'code': 'invalid_claims',
-                            'description': 'Permissions not included in JWT.'
-                        }, 400)
-
-    if permission not in payload['permissions']:
+def check_permissions(permission, payload, permissions=None):
+    # permissions, when given, is the set of the payload's permissions
+    if permissions is None:
+        if 'permissions' not in payload:
+            raise AuthError({
+                'code': 'invalid_claims',
+                'description': 'Permissions not included in JWT.'
+            }, 400)
+        permissions = payload['permissions']
+
+    if permission not in permissions:
         raise AuthError({
             'code': 'unauthorized',
             'description': 'Permission not found.'
@@ -103,8 +116,6 @@ def check_permissions(permission, payload):
     !!NOTE urlopen has a common certificate error described here: https://stackoverflow.com/questions/50236117/scraping-ssl-certificate-verify-failed-error-for-http-en-wikipedia-org
 '''
 def verify_decode_jwt(token):
-    jsonurl = urlopen(f'https://{AUTH0_DOMAIN}/.well-known/jwks.json')
-    jwks = json.loads(jsonurl.read())
     try:
         unverified_header = jwt.get_unverified_header(token)
     except JWTError as err:
@@ -112,22 +123,19 @@ def verify_decode_jwt(token):
             'code': 'JWTError',
             'description': err.args[0]
         }, 401)
-    rsa_key = {}
     if 'kid' not in unverified_header:
         raise AuthError({
             'code': 'invalid_header',
             'description': 'Authorization malformed.'
         }, 401)
 
-    for key in jwks['keys']:
-        if key['kid'] == unverified_header['kid']:
-            rsa_key = {
-                'kty': key['kty'],
-                'kid': key['kid'],
-                'use': key['use'],
-                'n': key['n'],
-                'e': key['e']
-            }
+    try:
+        rsa_key = jwks.get(unverified_header['kid'])
+    except JWKSError:
+        raise AuthError({
+            'code': 'jwks_unavailable',
+            'description': 'Unable to fetch the signing keys.'
+        }, 503)
     if rsa_key:
         try:
             payload = jwt.decode(
@@ -161,6 +169,19 @@ def verify_decode_jwt(token):
                 'description': 'Unable to find the appropriate key.'
             }, 400)
 
+'''
+verify_cached_jwt(token)
+    verify_decode_jwt(token), skipped for tokens verified before that have
+    not expired yet
+    return (payload, permissions), permissions being the set of the
+    payload's permissions or None when it has none
+'''
+def verify_cached_jwt(token):
+    verified = verified_tokens.get(token)
+    if verified is None:
+        verified = verified_tokens.set(token, verify_decode_jwt(token))
+    return verified
+
 '''
 @TODO implement @requires_auth(permission) decorator method
     @INPUTS
@@ -177,12 +198,12 @@ def requires_auth(permission=''):
         def wrapper(*args, **kwargs):
             try:
                 token = get_token_auth_header()
-                payload = verify_decode_jwt(token)
+                payload, permissions = verify_cached_jwt(token)
             except AuthError as err:
                 abort(err.status_code, err.error)
 
             try:
-                check_permissions(permission, payload)
+                check_permissions(permission, payload, permissions)
             except AuthError as err:
                 abort(err.status_code, err.error)
             return f(*args, **kwargs)
@@ -0,0 +1,123 @@
+'''
+JSON Web Key Set cache.
+
+The signing keys of the identity provider are fetched from its jwks.json once
+and kept in memory, indexed by key id (kid), so verifying a token does not
+wait on the identity provider:
+
+- keys older than ttl are still served while a background thread refetches
+  them (stale-while-revalidate); if the refetch fails they keep being served
+  for up to max_stale seconds
+- a kid that is not in the cache, e.g. right after the provider rotated its
+  keys, triggers a refetch. Concurrent requests share a single fetch, and
+  refetches for unknown kids happen at most once every min_refetch seconds,
+  so tokens with made-up kids cannot flood the provider
+'''
+
+import json
+import threading
+import time
+from urllib.request import urlopen
+
+
+class JWKSError(Exception):
+    '''
+    raised when no keys can be served, because the key set was never
+    fetched or was last fetched more than max_stale seconds ago
+    '''
+    pass
+
+
+'''
+KeyStore(url, ttl=600, max_stale=86400, min_refetch=30, timeout=5)
+    cache of the keys published at url; get(kid) returns the key as a dict
+    with kty, kid, use, n and e, or None for a kid the key set does not have
+'''
+class KeyStore(object):
+    def __init__(self, url, ttl=600, max_stale=86400, min_refetch=30, timeout=5,
+                 clock=time.monotonic):
+        self.url = url
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self.min_refetch = min_refetch
+        self.timeout = timeout
+        self.clock = clock
+        self.keys = {}
+        self.fetched_at = None
+        self.attempted_at = None
+        self.fetching = False
+        self.error = None
+        self.refresh_thread = None
+        self.lock = threading.Lock()
+        self.fetched = threading.Condition(self.lock)
+
+    def get(self, kid):
+        with self.lock:
+            now = self.clock()
+            recently = (self.attempted_at is not None
+                        and now - self.attempted_at < self.min_refetch)
+            if self.fetched_at is not None and now - self.fetched_at > self.ttl and not recently:
+                self._refresh_in_background()
+            usable = self._usable(now)
+            if usable and kid in self.keys:
+                return self.keys[kid]
+            # unknown kid, or nothing usable yet: fetch now, unless a fetch
+            # just happened
+            if not usable or not recently:
+                self._refresh_and_wait()
+            if not self._usable(self.clock()):
+                raise JWKSError('No signing keys available from {}: {}'.format(self.url, self.error))
+            return self.keys.get(kid)
+
+    def fetch(self):
+        # the key set at url, as {kid: key}
+        with urlopen(self.url, timeout=self.timeout) as response:
+            jwks = json.loads(response.read())
+        return {key['kid']: {
+            'kty': key['kty'],
+            'kid': key['kid'],
+            'use': key.get('use', 'sig'),
+            'n': key['n'],
+            'e': key['e']
+        } for key in jwks['keys'] if key.get('kty') == 'RSA' and 'kid' in key}
+
+    def _usable(self, now):
+        return self.fetched_at is not None and now - self.fetched_at <= self.max_stale
+
+    def _refresh_in_background(self):
+        # with the lock held
+        if not self.fetching:
+            self.fetching = True
+            self.refresh_thread = threading.Thread(target=self._refresh, daemon=True)
+            self.refresh_thread.start()
+
+    def _refresh_and_wait(self):
+        # with the lock held; joins the fetch in flight or starts one
+        if self.fetching:
+            while self.fetching:
+                self.fetched.wait()
+            return
+        self.fetching = True
+        self.lock.release()
+        try:
+            self._refresh()
+        finally:
+            self.lock.acquire()
+
+    def _refresh(self):
+        # fetches without the lock held; self.fetching is already set
+        keys = error = None
+        try:
+            keys = self.fetch()
+        except Exception as err:
+            error = err
+        finally:
+            with self.lock:
+                now = self.clock()
+                self.attempted_at = now
+                self.error = error
+                if keys is not None:
+                    self.keys = keys
+                    self.fetched_at = now
+                self.fetching = False
+                self.fetched.notify_all()
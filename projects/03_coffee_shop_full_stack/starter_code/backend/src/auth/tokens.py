@@ -0,0 +1,66 @@
+'''
+Verified token cache.
+
+Clients send the same bearer token with every request until it expires, so
+the payload of a token that passed verification is kept, keyed by the sha256
+of the token, until the token's exp. A cached token is not checked against
+the key set again: a token stays accepted until its exp even if its signing
+key is withdrawn in the meantime, as it would be by any API that does not
+revoke tokens.
+
+Along with the payload, the cache keeps its permissions as a frozenset, so
+permission checks do not scan the permissions list on every request.
+'''
+
+import collections
+import hashlib
+import threading
+import time
+
+
+'''
+TokenCache(max_tokens=10000)
+    in-process LRU of verified tokens, evicting the least recently used ones
+    beyond max_tokens; max_tokens=0 disables the cache
+'''
+class TokenCache(object):
+    def __init__(self, max_tokens=10000, clock=time.time):
+        self.max_tokens = max_tokens
+        self.clock = clock
+        self.tokens = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, token):
+        # (payload, permissions) for a cached, unexpired token, else None.
+        # permissions is None when the payload has no permissions claim
+        key = hashlib.sha256(token.encode()).digest()
+        with self.lock:
+            entry = self.tokens.get(key)
+            if entry is None:
+                return None
+            payload, permissions, expires = entry
+            if expires <= self.clock():
+                del self.tokens[key]
+                return None
+            self.tokens.move_to_end(key)
+            return payload, permissions
+
+    def set(self, token, payload):
+        # caches a verified payload and returns (payload, permissions);
+        # tokens without an exp are not cached
+        permissions = payload.get('permissions')
+        if permissions is not None:
+            permissions = frozenset(permissions)
+        expires = payload.get('exp')
+        if self.max_tokens and isinstance(expires, (int, float)):
+            key = hashlib.sha256(token.encode()).digest()
+            with self.lock:
+                self.tokens[key] = (payload, permissions, expires)
+                self.tokens.move_to_end(key)
+                while len(self.tokens) > self.max_tokens:
+                    self.tokens.popitem(last=False)
+        return payload, permissions
+
+    def clear(self):
+        with self.lock:
+            self.tokens.clear()
@@ -0,0 +1,216 @@
+'''
+Benchmarks for the Coffee Shop API.
+
+auth:       times the auth overhead of a request: verifying a token with
+            verify_decode_jwt, and going through a route decorated with
+            requires_auth, with and without the verified token cache
+startup:    starts fresh processes against a scratch sqlite database set up
+            by flask init-db, and times importing api.py and serving the
+            first GET /drinks, with the database as it is and after
+            db_drop_and_create_all(), as api.py used to run at import
+
+Tokens are signed with a generated 2048-bit RSA key, served as a data: URL
+JWKS so no identity provider is involved. Run from the src directory:
+
+    python benchmark.py [auth] [startup] [--requests 2000] [--runs 10] [--output results.json]
+
+With --output, the results are also written as JSON, along with the commit
+they were measured on, so that runs can be diffed across commits.
+'''
+import argparse
+import base64
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.parse
+
+from Crypto.PublicKey import RSA
+from flask import Flask, jsonify
+from jose import jwt
+
+from auth import auth
+from auth.jwks import KeyStore
+from auth.tokens import TokenCache
+
+REQUESTS = 2000
+RUNS = 10
+SRC = os.path.dirname(os.path.abspath(__file__))
+
+# run in a fresh interpreter for every startup; prints the timings as JSON
+STARTUP = '''
+import json, os, time
+start = time.perf_counter()
+import api
+imported = time.perf_counter()
+if os.environ.get('BENCHMARK_RESET'):
+    with api.app.app_context():
+        api.db_drop_and_create_all()
+res = api.app.test_client().get('/drinks', headers={'Authorization': 'Bearer ' + os.environ['BENCHMARK_TOKEN']})
+assert res.status_code == 200, res.status_code
+served = time.perf_counter()
+print(json.dumps({'import_ms': (imported - start) * 1000, 'first_request_ms': (served - imported) * 1000}))
+'''
+
+
+def base64url_uint(number):
+    data = number.to_bytes((number.bit_length() + 7) // 8, 'big')
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode()
+
+
+def signing_key():
+    # (private key PEM, JWKS as a data: URL)
+    private = RSA.generate(2048)
+    key = {'kty': 'RSA', 'kid': 'benchmark', 'use': 'sig',
+           'n': base64url_uint(private.n), 'e': base64url_uint(private.e)}
+    return private.exportKey('PEM').decode(), 'data:application/json,' + urllib.parse.quote(json.dumps({'keys': [key]}))
+
+
+def token(pem):
+    return jwt.encode({
+        'iss': 'https://' + auth.AUTH0_DOMAIN + '/',
+        'aud': auth.API_AUDIENCE,
+        'sub': 'auth0|benchmark',
+        'exp': int(time.time()) + 3600,
+        'permissions': ['get:drinks', 'get:drinks-detail', 'post:drinks', 'patch:drinks', 'delete:drinks']
+    }, pem, algorithm='RS256', headers={'kid': 'benchmark'})
+
+
+def timed(call, count):
+    # (median, p99) microseconds per call
+    timings = []
+    for i in range(count):
+        start = time.perf_counter()
+        call()
+        timings.append((time.perf_counter() - start) * 1000000)
+    percentiles = statistics.quantiles(timings, n=100, method='inclusive')
+    return round(statistics.median(timings), 1), round(percentiles[98], 1)
+
+
+def benchmark_auth(args):
+    pem, jwks_url = signing_key()
+    bearer = token(pem)
+    auth.jwks = KeyStore(jwks_url)
+
+    app = Flask(__name__)
+
+    @app.route('/drinks-detail')
+    @auth.requires_auth('get:drinks-detail')
+    def drinks_detail():
+        return jsonify({'success': True})
+
+    @app.route('/public')
+    def public():
+        return jsonify({'success': True})
+
+    client = app.test_client()
+    headers = {'Authorization': 'Bearer ' + bearer}
+
+    def request(path):
+        res = client.get(path, headers=headers)
+        assert res.status_code == 200, (path, res.status_code)
+
+    paths = [
+        ('verify_decode_jwt', None, lambda: auth.verify_decode_jwt(bearer)),
+        ('verify_cached_jwt', TokenCache(), lambda: auth.verify_cached_jwt(bearer)),
+        ('request, no auth', None, lambda: request('/public')),
+        ('request, uncached', TokenCache(0), lambda: request('/drinks-detail')),
+        ('request, cached', TokenCache(), lambda: request('/drinks-detail')),
+    ]
+    results = {}
+    print('{:>20} {:>10} {:>10}'.format('', 'p50 us', 'p99 us'))
+    for name, cache, call in paths:
+        auth.verified_tokens = cache if cache is not None else TokenCache(0)
+        # warms the key store and the cache
+        call()
+        p50, p99 = timed(call, args.requests)
+        results[name] = {'requests': args.requests, 'p50_us': p50, 'p99_us': p99}
+        print('{:>20} {:>10.1f} {:>10.1f}'.format(name, p50, p99))
+    return results
+
+
+def benchmark_startup(args):
+    pem, jwks_url = signing_key()
+    with tempfile.TemporaryDirectory() as directory:
+        env = dict(os.environ,
+                   PYTHONPATH=SRC,
+                   FLASK_APP='api.py',
+                   DATABASE_URL='sqlite:///' + os.path.join(directory, 'benchmark.db'),
+                   JWKS_URL=jwks_url,
+                   BENCHMARK_TOKEN=token(pem))
+        subprocess.run([sys.executable, '-m', 'flask', 'init-db'], env=env, cwd=SRC, check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+        results = {}
+        print('{:>26} {:>10} {:>10} {:>10} {:>10}'.format('', 'import ms', 'first ms', 'total ms', 'process ms'))
+        for name, reset in [('existing database', False), ('drop and create', True)]:
+            env.pop('BENCHMARK_RESET', None)
+            if reset:
+                env['BENCHMARK_RESET'] = '1'
+            runs = []
+            for i in range(args.runs):
+                start = time.perf_counter()
+                output = subprocess.run([sys.executable, '-c', STARTUP], env=env, cwd=SRC, check=True,
+                                        stdout=subprocess.PIPE).stdout
+                run = json.loads(output.decode().strip().splitlines()[-1])
+                run['process_ms'] = (time.perf_counter() - start) * 1000
+                runs.append(run)
+            result = {key: round(statistics.median(run[key] for run in runs), 1)
+                      for key in ['import_ms', 'first_request_ms', 'process_ms']}
+            result['import_to_first_response_ms'] = round(statistics.median(
+                run['import_ms'] + run['first_request_ms'] for run in runs), 1)
+            result['runs'] = args.runs
+            results[name] = result
+            print('{:>26} {:>10.1f} {:>10.1f} {:>10.1f} {:>10.1f}'.format(
+                name, result['import_ms'], result['first_request_ms'],
+                result['import_to_first_response_ms'], result['process_ms']))
+    return results
+
+
+BENCHMARKS = {
+    'auth': benchmark_auth,
+    'startup': benchmark_startup,
+}
+
+
+def commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the Coffee Shop API.')
+    parser.add_argument('benchmarks', nargs='*', help='any of {}; all by default'.format(', '.join(sorted(BENCHMARKS))))
+    parser.add_argument('--requests', type=int, default=REQUESTS, help='calls timed per measurement')
+    parser.add_argument('--runs', type=int, default=RUNS, help='process starts per startup measurement')
+    parser.add_argument('--output', help='file to write the results to as JSON')
+    args = parser.parse_args()
+    for name in args.benchmarks:
+        if name not in BENCHMARKS:
+            parser.error('unknown benchmark {}'.format(name))
+
+    results = {}
+    for name in args.benchmarks or sorted(BENCHMARKS):
+        results[name] = BENCHMARKS[name](args)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'commit': commit(),
+                'created': datetime.datetime.utcnow().isoformat() + 'Z',
+                'python': platform.python_version(),
+                'options': {'requests': args.requests, 'runs': args.runs},
+                'results': results
+            }, f, indent=2, sort_keys=True)
+            f.write('\n')
+
+
+if __name__ == '__main__':
+    main()
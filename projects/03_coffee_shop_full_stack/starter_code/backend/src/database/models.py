@@ -1,11 +1,19 @@
 import os
-from sqlalchemy import Column, String, Integer
+import hashlib
+import threading
+import time
+from sqlalchemy import Column, String, Integer, JSON
+from sqlalchemy.orm import validates
 from flask_sqlalchemy import SQLAlchemy
 import json
 
 database_filename = "database.db"
 project_dir = os.path.dirname(os.path.abspath(__file__))
-database_path = "sqlite:///{}".format(os.path.join(project_dir, database_filename))
+database_path = os.environ.get(
+    "DATABASE_URL", "sqlite:///{}".format(os.path.join(project_dir, database_filename)))
+# seconds a menu snapshot is served before it is rebuilt, so that drinks
+# written by other processes show up
+MENU_TTL = 60
 
 db = SQLAlchemy()
 
@@ -33,12 +41,23 @@ db_drop_and_create_all()
 def db_drop_and_create_all():
     db.drop_all()
     db.create_all()
-    # add one demo row which is helping in POSTMAN test
-    drink = Drink(
-        title='water',
-        recipe='[{"name": "water", "color": "blue", "parts": 1}]'
-    )
-    drink.insert()
+    seed_db()
+
+
+'''
+seed_db()
+    adds one demo row, which is helping in POSTMAN test, to a database
+    without drinks
+'''
+
+
+def seed_db():
+    if Drink.query.first() is None:
+        drink = Drink(
+            title='water',
+            recipe=[{"name": "water", "color": "blue", "parts": 1}]
+        )
+        drink.insert()
 # ROUTES
 
 '''
@@ -52,9 +71,23 @@ class Drink(db.Model):
     id = Column(Integer().with_variant(Integer, "sqlite"), primary_key=True)
     # String Title
     title = Column(String(80), unique=True)
-    # the ingredients blob - this stores a lazy json blob
+    # the ingredients, as JSON
     # the required datatype is [{'color': string, 'name':string, 'parts':number}]
-    recipe = Column(String(180), nullable=False)
+    recipe = Column(JSON, nullable=False)
+    # the recipe without ingredient names, as served by short(); kept in
+    # step with recipe so listings don't rebuild it
+    short_recipe = Column(JSON, nullable=False)
+
+    '''
+    validate_recipe()
+        sets short_recipe whenever recipe is set
+        raises KeyError or TypeError for a recipe without colors and parts
+    '''
+
+    @validates('recipe')
+    def validate_recipe(self, key, recipe):
+        self.short_recipe = [{'color': r['color'], 'parts': r['parts']} for r in recipe]
+        return recipe
 
     '''
     short()
@@ -62,12 +95,10 @@ class Drink(db.Model):
     '''
 
     def short(self):
-        print(json.loads(self.recipe))
-        short_recipe = [{'color': r['color'], 'parts': r['parts']} for r in json.loads(self.recipe)]
         return {
             'id': self.id,
             'title': self.title,
-            'recipe': short_recipe
+            'recipe': self.short_recipe
         }
 
     '''
@@ -79,7 +110,7 @@ class Drink(db.Model):
         return {
             'id': self.id,
             'title': self.title,
-            'recipe': json.loads(self.recipe)
+            'recipe': self.recipe
         }
 
     '''
@@ -95,6 +126,7 @@ class Drink(db.Model):
     def insert(self):
         db.session.add(self)
         db.session.commit()
+        menu.refresh()
 
     '''
     delete()
@@ -108,6 +140,7 @@ class Drink(db.Model):
     def delete(self):
         db.session.delete(self)
         db.session.commit()
+        menu.refresh()
 
     '''
     update()
@@ -121,6 +154,73 @@ class Drink(db.Model):
 
     def update(self):
         db.session.commit()
+        menu.refresh()
 
     def __repr__(self):
         return json.dumps(self.short())
+
+
+'''
+Menu
+    snapshot of every drink, serialized once as the JSON bodies of
+    GET /drinks (short) and GET /drinks-detail (long), each with an ETag
+    computed from its bytes. The snapshot is rebuilt when a drink is
+    inserted, updated or deleted, and ttl seconds after it was built
+'''
+
+
+class Menu(object):
+    def __init__(self, ttl=MENU_TTL):
+        self.ttl = ttl
+        self.version = 0
+        self.snapshot = None
+        self.lock = threading.Lock()
+
+    '''
+    get()
+        the current snapshot, a dict with the short and long bodies as
+        bytes and their ETags as short_etag and long_etag
+    '''
+
+    def get(self):
+        snapshot = self.snapshot
+        if snapshot is None or time.monotonic() - snapshot['built_at'] > self.ttl:
+            snapshot = self.rebuild()
+        return snapshot
+
+    '''
+    rebuild()
+        builds a snapshot from the database and serves it from then on,
+        unless the menu was refreshed while it was being built
+    '''
+
+    def rebuild(self):
+        with self.lock:
+            version = self.version
+        drinks = Drink.query.order_by(Drink.id).all()
+        snapshot = {'version': version, 'built_at': time.monotonic()}
+        for form in ['short', 'long']:
+            body = json.dumps({
+                'success': True,
+                'drinks': [getattr(drink, form)() for drink in drinks]
+            }, separators=(',', ':')).encode()
+            snapshot[form] = body
+            snapshot[form + '_etag'] = hashlib.sha1(body).hexdigest()
+        with self.lock:
+            if self.version == version:
+                self.snapshot = snapshot
+        return snapshot
+
+    '''
+    refresh()
+        discards the snapshot and builds a new one, after drinks changed
+    '''
+
+    def refresh(self):
+        with self.lock:
+            self.version += 1
+            self.snapshot = None
+        return self.rebuild()
+
+
+menu = Menu()
@@ -0,0 +1,30 @@
+"""drink table
+
+Revision ID: 5c1f0e2b7a90
+Revises: 
+Create Date: 2026-10-18 21:02:14.318206
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5c1f0e2b7a90'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('drink',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('title', sa.String(length=80), nullable=True),
+    sa.Column('recipe', sa.String(length=180), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('title')
+    )
+
+
+def downgrade():
+    op.drop_table('drink')
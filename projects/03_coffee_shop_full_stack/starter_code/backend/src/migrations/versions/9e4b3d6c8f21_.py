@@ -0,0 +1,56 @@
+"""recipe as JSON, with the short projection stored alongside
+
+Revision ID: 9e4b3d6c8f21
+Revises: 5c1f0e2b7a90
+Create Date: 2026-10-18 21:09:40.725113
+
+"""
+import json
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9e4b3d6c8f21'
+down_revision = '5c1f0e2b7a90'
+branch_labels = None
+depends_on = None
+
+drink = sa.table('drink',
+    sa.column('id', sa.Integer),
+    sa.column('recipe', sa.Text),
+    sa.column('short_recipe', sa.Text)
+)
+
+
+def upgrade():
+    with op.batch_alter_table('drink', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('short_recipe', sa.JSON(), nullable=True))
+
+    # the recipes are JSON text already; only the projections are computed
+    connection = op.get_bind()
+    for drink_id, recipe in connection.execute(sa.select(drink.c.id, drink.c.recipe)).fetchall():
+        short_recipe = [{'color': r['color'], 'parts': r['parts']} for r in json.loads(recipe)]
+        connection.execute(drink.update().where(drink.c.id == drink_id).values(
+            short_recipe=json.dumps(short_recipe)))
+
+    with op.batch_alter_table('drink', schema=None) as batch_op:
+        batch_op.alter_column('recipe',
+               existing_type=sa.String(length=180),
+               type_=sa.JSON(),
+               existing_nullable=False,
+               postgresql_using='recipe::json')
+        batch_op.alter_column('short_recipe',
+               existing_type=sa.JSON(),
+               nullable=False)
+
+
+def downgrade():
+    with op.batch_alter_table('drink', schema=None) as batch_op:
+        batch_op.alter_column('recipe',
+               existing_type=sa.JSON(),
+               type_=sa.String(length=180),
+               existing_nullable=False,
+               postgresql_using='recipe::text')
+        batch_op.drop_column('short_recipe')
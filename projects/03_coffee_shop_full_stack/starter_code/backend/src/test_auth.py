@@ -0,0 +1,313 @@
+import base64
+import json
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from Crypto.PublicKey import RSA
+from flask import Flask, jsonify
+from jose import jwt
+
+from auth import auth
+from auth.auth import AuthError, requires_auth, verify_decode_jwt
+from auth.jwks import KeyStore, JWKSError
+from auth.tokens import TokenCache
+
+
+def base64url_uint(number):
+    # an integer as the unpadded base64url of its big-endian bytes, as JWKs
+    # encode the modulus and the exponent
+    data = number.to_bytes((number.bit_length() + 7) // 8, 'big')
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode()
+
+
+class SigningKey(object):
+    # an RSA key pair signing tokens the way Auth0 does, through pycryptodome
+    # so that the tests only need the pinned requirements
+    def __init__(self, kid):
+        self.kid = kid
+        key = RSA.generate(1024)
+        self.pem = key.exportKey('PEM').decode()
+        self.jwk = {'kty': 'RSA', 'kid': kid, 'use': 'sig',
+                    'n': base64url_uint(key.n), 'e': base64url_uint(key.e)}
+
+    def token(self, permissions=(), expires_in=3600):
+        claims = {
+            'iss': 'https://' + auth.AUTH0_DOMAIN + '/',
+            'aud': auth.API_AUDIENCE,
+            'sub': 'auth0|test',
+            'exp': int(time.time()) + expires_in
+        }
+        if permissions is not None:
+            claims['permissions'] = list(permissions)
+        return jwt.encode(claims, self.pem, algorithm='RS256', headers={'kid': self.kid})
+
+
+class JWKSServer(object):
+    # local stand-in for the identity provider's /.well-known/jwks.json,
+    # counting the requests it gets; it can be slowed down or made to fail
+    def __init__(self):
+        self.keys = []
+        self.requests = 0
+        self.delay = 0
+        self.failing = False
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server.requests += 1
+                time.sleep(server.delay)
+                if server.failing:
+                    self.send_error(500)
+                    return
+                body = json.dumps({'keys': server.keys}).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:{}/.well-known/jwks.json'.format(self.httpd.server_port)
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class Clock(object):
+    # a monotonic clock the tests move forward
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class KeyStoreTestCase(unittest.TestCase):
+    """This class represents the JWKS key cache test case"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.key = SigningKey('key-1')
+        cls.rotated_key = SigningKey('key-2')
+
+    def setUp(self):
+        self.server = JWKSServer()
+        self.server.keys = [self.key.jwk]
+        self.clock = Clock()
+        self.store = KeyStore(self.server.url, ttl=600, max_stale=3600, min_refetch=30,
+                              timeout=2, clock=self.clock)
+        self.default_store = auth.jwks
+        auth.jwks = self.store
+
+    def tearDown(self):
+        auth.jwks = self.default_store
+        if self.store.refresh_thread is not None:
+            self.store.refresh_thread.join()
+        self.server.close()
+
+    def test_keys_fetched_once(self):
+        for i in range(10):
+            payload = verify_decode_jwt(self.key.token(['get:drinks-detail']))
+            self.assertEqual(payload['permissions'], ['get:drinks-detail'])
+        self.assertEqual(self.server.requests, 1)
+
+    def test_unknown_kid_refetches(self):
+        verify_decode_jwt(self.key.token())
+        self.server.keys = [self.key.jwk, self.rotated_key.jwk]
+        self.clock.now += 31
+
+        payload = verify_decode_jwt(self.rotated_key.token(['post:drinks']))
+
+        self.assertEqual(payload['permissions'], ['post:drinks'])
+        self.assertEqual(self.server.requests, 2)
+
+    def test_unknown_kid_refetch_is_rate_limited(self):
+        verify_decode_jwt(self.key.token())
+        self.clock.now += 10
+
+        with self.assertRaises(AuthError) as raised:
+            verify_decode_jwt(self.rotated_key.token())
+
+        self.assertEqual(raised.exception.status_code, 400)
+        self.assertEqual(raised.exception.error['description'], 'Unable to find the appropriate key.')
+        self.assertEqual(self.server.requests, 1)
+
+    def test_concurrent_unknown_kids_share_one_fetch(self):
+        self.server.delay = 0.2
+        results = []
+
+        def verify():
+            results.append(self.store.get('key-1'))
+
+        threads = [threading.Thread(target=verify) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(self.server.requests, 1)
+        self.assertEqual(results, [self.store.keys['key-1']] * 8)
+
+    def test_stale_keys_served_while_refreshing(self):
+        verify_decode_jwt(self.key.token())
+        self.server.delay = 0.2
+        self.server.keys = [self.rotated_key.jwk]
+        self.clock.now += 601
+
+        # answered from the expired keys without waiting for the refresh
+        start = time.perf_counter()
+        verify_decode_jwt(self.key.token())
+        self.assertLess(time.perf_counter() - start, 0.2)
+
+        self.store.refresh_thread.join()
+        self.assertEqual(self.server.requests, 2)
+        self.assertEqual(list(self.store.keys), ['key-2'])
+
+    def test_stale_keys_served_while_provider_is_down(self):
+        verify_decode_jwt(self.key.token())
+        self.server.failing = True
+        self.clock.now += 601
+
+        verify_decode_jwt(self.key.token())
+        self.store.refresh_thread.join()
+        verify_decode_jwt(self.key.token())
+
+        self.assertEqual(self.server.requests, 2)
+        self.assertEqual(list(self.store.keys), ['key-1'])
+
+    def test_503_without_keys(self):
+        self.server.failing = True
+
+        with self.assertRaises(AuthError) as raised:
+            verify_decode_jwt(self.key.token())
+
+        self.assertEqual(raised.exception.status_code, 503)
+        self.assertEqual(raised.exception.error['code'], 'jwks_unavailable')
+
+    def test_keys_dropped_after_max_stale(self):
+        self.store.get('key-1')
+        self.server.failing = True
+        self.clock.now += 3601
+
+        with self.assertRaises(JWKSError):
+            self.store.get('key-1')
+
+
+class TokenCacheTestCase(unittest.TestCase):
+    """This class represents the verified token cache test case"""
+
+    def setUp(self):
+        self.clock = Clock()
+        self.cache = TokenCache(max_tokens=2, clock=self.clock)
+
+    def test_cached_until_exp(self):
+        payload = {'sub': 'a', 'exp': 1060, 'permissions': ['get:drinks', 'post:drinks']}
+        self.cache.set('token-a', payload)
+
+        self.assertEqual(self.cache.get('token-a'), (payload, frozenset(['get:drinks', 'post:drinks'])))
+        self.clock.now = 1060
+        self.assertIsNone(self.cache.get('token-a'))
+
+    def test_least_recently_used_evicted(self):
+        for token in ['token-a', 'token-b']:
+            self.cache.set(token, {'sub': token, 'exp': 2000})
+        self.cache.get('token-a')
+        self.cache.set('token-c', {'sub': 'token-c', 'exp': 2000})
+
+        self.assertIsNone(self.cache.get('token-b'))
+        self.assertIsNotNone(self.cache.get('token-a'))
+        self.assertIsNotNone(self.cache.get('token-c'))
+
+    def test_not_cached_without_exp(self):
+        self.assertEqual(self.cache.set('token-a', {'sub': 'a'}), ({'sub': 'a'}, None))
+        self.assertIsNone(self.cache.get('token-a'))
+
+
+class RequiresAuthTestCase(unittest.TestCase):
+    """This class represents the requires_auth decorator test case"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.key = SigningKey('key-1')
+
+    def setUp(self):
+        self.server = JWKSServer()
+        self.server.keys = [self.key.jwk]
+        self.defaults = auth.jwks, auth.verified_tokens
+        auth.jwks = KeyStore(self.server.url)
+        auth.verified_tokens = TokenCache()
+
+        self.app = Flask(__name__)
+
+        @self.app.route('/drinks-detail')
+        @requires_auth('get:drinks-detail')
+        def drinks_detail():
+            return jsonify({'success': True})
+
+        @self.app.errorhandler(400)
+        @self.app.errorhandler(403)
+        def auth_error(error):
+            return jsonify(error.description), error.code
+
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        auth.jwks, auth.verified_tokens = self.defaults
+        self.server.close()
+
+    def get(self, token):
+        return self.client.get('/drinks-detail', headers={'Authorization': 'Bearer ' + token})
+
+    def test_verified_once(self):
+        token = self.key.token(['get:drinks-detail'])
+        decoded = []
+        verify = auth.verify_decode_jwt
+
+        def counting_verify(token):
+            decoded.append(token)
+            return verify(token)
+
+        auth.verify_decode_jwt = counting_verify
+        try:
+            for i in range(3):
+                self.assertEqual(self.get(token).status_code, 200)
+        finally:
+            auth.verify_decode_jwt = verify
+
+        self.assertEqual(decoded, [token])
+
+    def test_cached_token_without_permission(self):
+        token = self.key.token(['get:drinks'])
+
+        for i in range(2):
+            res = self.get(token)
+            self.assertEqual(res.status_code, 403)
+            self.assertEqual(res.get_json()['code'], 'unauthorized')
+
+    def test_cached_token_without_permissions_claim(self):
+        token = self.key.token(None)
+
+        for i in range(2):
+            res = self.get(token)
+            self.assertEqual(res.status_code, 400)
+            self.assertEqual(res.get_json()['code'], 'invalid_claims')
+
+    def test_invalid_token_not_cached(self):
+        token = self.key.token(['get:drinks-detail'])
+        tampered = token[:-4] + ('AAAA' if not token.endswith('AAAA') else 'BBBB')
+
+        self.assertEqual(self.get(tampered).status_code, 400)
+        self.assertEqual(len(auth.verified_tokens.tokens), 0)
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
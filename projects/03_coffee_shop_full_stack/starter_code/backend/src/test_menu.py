@@ -0,0 +1,96 @@
+import json
+import os
+import tempfile
+import unittest
+
+from flask import Flask
+from sqlalchemy import event
+
+from database.models import db, Drink, menu
+
+
+class MenuTestCase(unittest.TestCase):
+    """This class represents the drink menu snapshot test case"""
+
+    @classmethod
+    def setUpClass(cls):
+        handle, cls.database_path = tempfile.mkstemp(suffix='.db')
+        os.close(handle)
+        cls.app = Flask(__name__)
+        cls.app.config["SQLALCHEMY_DATABASE_URI"] = 'sqlite:///' + cls.database_path
+        cls.app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+        db.init_app(cls.app)
+
+    @classmethod
+    def tearDownClass(cls):
+        os.remove(cls.database_path)
+
+    def setUp(self):
+        self.context = self.app.app_context()
+        self.context.push()
+        db.create_all()
+        Drink(title='water', recipe=[{'name': 'water', 'color': 'blue', 'parts': 1}]).insert()
+        self.statements = []
+        event.listen(db.engine, 'before_cursor_execute', self.count)
+
+    def tearDown(self):
+        event.remove(db.engine, 'before_cursor_execute', self.count)
+        db.session.remove()
+        db.drop_all()
+        menu.snapshot = None
+        menu.ttl = 60
+        self.context.pop()
+
+    def count(self, conn, cursor, statement, *args):
+        self.statements.append(statement)
+
+    def drinks(self, form):
+        return json.loads(menu.get()[form])['drinks']
+
+    def test_short_and_long_forms(self):
+        self.assertEqual(self.drinks('short'), [{'id': 1, 'title': 'water', 'recipe': [{'color': 'blue', 'parts': 1}]}])
+        self.assertEqual(self.drinks('long'), [{'id': 1, 'title': 'water', 'recipe': [{'name': 'water', 'color': 'blue', 'parts': 1}]}])
+
+    def test_served_without_queries(self):
+        for i in range(5):
+            menu.get()
+
+        self.assertEqual(self.statements, [])
+
+    def test_rebuilt_after_ttl(self):
+        menu.ttl = -1
+        menu.get()
+
+        self.assertEqual(len(self.statements), 1)
+
+    def test_refreshed_on_insert(self):
+        etag = menu.get()['short_etag']
+        Drink(title='latte', recipe=[{'name': 'milk', 'color': 'grey', 'parts': 3}]).insert()
+
+        self.assertEqual([drink['title'] for drink in self.drinks('short')], ['water', 'latte'])
+        self.assertNotEqual(menu.get()['short_etag'], etag)
+
+    def test_refreshed_on_update(self):
+        drink = Drink.query.filter(Drink.id == 1).one_or_none()
+        drink.recipe = [{'name': 'water', 'color': 'clear', 'parts': 2}]
+        drink.update()
+
+        self.assertEqual(self.drinks('short')[0]['recipe'], [{'color': 'clear', 'parts': 2}])
+
+    def test_refreshed_on_delete(self):
+        Drink.query.filter(Drink.id == 1).one_or_none().delete()
+
+        self.assertEqual(self.drinks('long'), [])
+
+    def test_etag_stable_for_unchanged_menu(self):
+        snapshot = menu.get()
+        rebuilt = menu.rebuild()
+
+        self.assertEqual(rebuilt['short_etag'], snapshot['short_etag'])
+        self.assertEqual(rebuilt['long_etag'], snapshot['long_etag'])
+        self.assertNotEqual(snapshot['short_etag'], snapshot['long_etag'])
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()